@@ -1,42 +1,69 @@
+import argparse
 import os
+import signal
 
 os.environ["OPENCV_VIDEOIO_MSMF_ENABLE_HW_TRANSFORMS"] = "0"
 from tkinter import messagebox, simpledialog
 
 import customtkinter as ctk
 import tkinter as tk
-import cv2
 from dotenv import load_dotenv
 from PIL import Image, ImageOps, ImageTk
-from pyzbar.pyzbar import decode
 
+from src.camera import CameraWorker, ISBNStream, get_profiles, invalidate_profiles
 from src.github import get_latest_tag
-from src.google_books import search_isbn
-from src.notion import NotionDB, NotionPage
+from src.http_cache import http_cache
+from src.library import Library
+from src.profiling import Profiler
+from src.recorder import SessionRecorder, SessionReplayer
+from src.station import Station
 
 # modify these values when creating new release
 VERSION = "v1.5.1"
 RELEASED_DATE = "2024-05-02"
 
+# Notion databases; override with comma-separated IDs in environment variable 'NOTION_DATABASE_IDS'
+DATABASE_IDS = ["3dacfb355eb34f0b9d127a988539809a"]
 
-def is_valid_ISBN(value: str) -> bool:
-    """Function to validate if a given str is ISBN."""
-    try:
-        int(value)
-        if len(value) == 13:
-            return value[0:3] == "978" or value[0:3] == "979"
-        elif len(value) == 10:
-            return True
-        else:
-            return False
-    except:
-        return False
+# cache of camera settings; delete it to probe cameras again
+CAMERA_PROFILES = "camera_profiles.json"
 
 
 class App(ctk.CTk):
-    def __init__(self, **kwargs):
+    def __init__(self, record: str | None = None, replay: str | None = None, speed: float = 1.0, **kwargs):
+        """
+        Parameters
+        ----------
+        record: str | None
+            Directory to record camera frames and HTTP exchanges into.
+        replay: str | None
+            Directory of recorded session to replay instead of cameras and network.
+        speed: float
+            Speed of replay. Recorded timing is ignored if 0.
+        """
         super().__init__(**kwargs)
 
+        # --- profiling ---
+        self.profiler = Profiler()
+        if hasattr(signal, "SIGUSR1"):
+            # kill -USR1 <pid>: start/stop cProfile and sampling, kill -USR2 <pid>: memory snapshot
+            signal.signal(signal.SIGUSR1, lambda *_: self.after(0, self.profiler.toggle))
+            signal.signal(signal.SIGUSR2, lambda *_: self.after(0, self.profiler.take_snapshot))
+
+        # --- session recording / replay ---
+        self.recorder = None
+        self.replayer = None
+        if replay or record:
+            # responses revalidated against a local cache would be recorded as bodiless 304s
+            http_cache.isolate()
+        if replay:
+            self.replayer = SessionReplayer(replay, speed=speed)
+            self.replayer.start()
+            os.environ.setdefault("NOTION_API_KEY", "replay")
+        elif record:
+            self.recorder = SessionRecorder(record)
+            self.recorder.start()
+
         # --- settings ---
         self.title("Notion Book Stock")
         self.geometry("1024x640")
@@ -47,26 +74,18 @@ class App(ctk.CTk):
         # --- API key & camera setup ---
         try:
             # create '.env' file if not exists
-            if not load_dotenv():
+            if not load_dotenv() and not self.replayer:
                 self.create_dotenv()
                 self.set_api()
 
             assert os.getenv("NOTION_API_KEY") is not None, "Environment variable 'NOTION_API_KEY' doesn't exist."
 
             # get available camera(s)
-            self.available_cam = []
-            for i in range(5):
-                try:
-                    print(f"Checking camera {i} is available...")
-                    cap = cv2.VideoCapture(i)
-                    if cap is None or not cap.isOpened():
-                        raise IndexError("Camera index out of range.")
-                    else:
-                        self.available_cam.append(i)
-                    cap.release()
-                except IndexError:
-                    cap.release()
-                    break
+            if self.replayer:
+                self.cam_profiles = {i: None for i in self.replayer.cameras()}
+            else:
+                self.cam_profiles = get_profiles(CAMERA_PROFILES)
+            self.available_cam = list(self.cam_profiles)
             assert len(self.available_cam) != 0, "No video source detected."
 
             # --- check updates ---
@@ -82,17 +101,46 @@ class App(ctk.CTk):
 
         # --- Notion database ---
         print("Initializing database...")
-        self.db = NotionDB(databse_id="3dacfb355eb34f0b9d127a988539809a")
-        self.history = [data["isbn"] for data in self.db.save_bookdata()["books"]]
-        self.loc_choice = self.db.get_location_tags()
+        database_ids = os.getenv("NOTION_DATABASE_IDS")
+        database_ids = [s.strip() for s in database_ids.split(",") if s.strip()] if database_ids else DATABASE_IDS
+        self.library = Library(database_ids)
+        try:
+            self.library.validate()
+        except ValueError as e:
+            print(e)
+            messagebox.showerror("Invalid database", str(e))
+            exit()
+        self.library.sync()
+        self.loc_choice = self.library.get_locations()
         print("Done!")
         
         # start video capturing
-        self.vcap = cv2.VideoCapture(self.available_cam[0])
-        self.vwidth = self.vcap.get(cv2.CAP_PROP_FRAME_WIDTH)
-        self.vheight = self.vcap.get(cv2.CAP_PROP_FRAME_HEIGHT)
+        self.isbn_stream = ISBNStream()
+        self.workers = {}
+        self.cam_location = {}
+        self.current_cam = self.available_cam[0]
+        self.start_camera(self.current_cam)
+        if self.current_cam not in self.workers:
+            print("Failed to open camera {}.".format(self.current_cam))
+            exit()
+        self.vwidth = self.workers[self.current_cam].vwidth
+        self.vheight = self.workers[self.current_cam].vheight
+        self.protocol("WM_DELETE_WINDOW", self.on_close)
+
+        # lookup, upload and relocation of detected books; metadata from Google Books, openBD and NDL
+        self.station = Station(
+            self.library,
+            ask_update=self.ask_update,
+            confirm_upload=self.confirm_upload,
+            notify=lambda title, message: messagebox.showerror(title, message),
+            on_failure=self.show_failure,
+            stage=lambda name: self.profiler.section(),
+            wrap=self.profiler.wrap,
+        )
+        self.covers = self.station.covers
         
         # --- create GUI ---
+        self.create_menu()
         self.create_frames()
         self.create_widgets()
 
@@ -100,6 +148,16 @@ class App(ctk.CTk):
         self.delay = 40  # ms
         self.update_canvas()
 
+    def create_menu(self):
+        """Method to create menu bar."""
+        menubar = tk.Menu(self)
+        profile_menu = tk.Menu(menubar, tearoff=False)
+        profile_menu.add_command(label="Start/stop profiling", command=self.profiler.toggle)
+        profile_menu.add_command(label="Take memory snapshot", command=self.profiler.take_snapshot)
+        profile_menu.add_command(label="Stop memory tracing", command=self.profiler.stop_tracemalloc)
+        menubar.add_cascade(label="Profiling", menu=profile_menu)
+        self.configure(menu=menubar)
+
     def create_frames(self):
         """Method to create frames."""
         self.side_frame = ctk.CTkFrame(self)
@@ -125,9 +183,11 @@ class App(ctk.CTk):
             text_color="orange",
             font=ctk.CTkFont(size=16),
             state="readonly",
+            command=self.set_location,
         )
         if self.loc_choice:
             self.loc_cmbbox.set(self.loc_choice[0])
+            self.cam_location[self.current_cam] = self.loc_choice[0]
         self.loc_button = ctk.CTkButton(
             self.loc_frame,
             text="Add location",
@@ -151,123 +211,223 @@ class App(ctk.CTk):
             command=self.switch_source,
         )
         self.cam_cmbbox.set(f"Camera {self.available_cam[0]}")
+        self.cam_info_label = ctk.CTkLabel(self.camsrc_frame, text="", font=ctk.CTkFont(size=12))
         self.cam_label.pack(pady=5)
         self.cam_cmbbox.pack(padx=20)
+        self.cam_info_label.pack(pady=2)
+
+        # cameras running concurrently
+        self.cam_checkbox = {}
+        for i in self.available_cam:
+            checkbox = ctk.CTkCheckBox(
+                self.camsrc_frame,
+                text=f"Scan with camera {i}",
+                font=ctk.CTkFont(size=14),
+                command=lambda i=i: self.toggle_camera(i),
+            )
+            if i in self.workers:
+                checkbox.select()
+            checkbox.pack(padx=20, pady=2, anchor="w")
+            self.cam_checkbox[i] = checkbox
 
         # --- right frame ---
         self.canvas = ctk.CTkCanvas(self.cam_frame, highlightthickness=0)
+        self.canvas_image = None
         self.canvas.pack(expand=True, fill="both")
 
     def update_canvas(self):
-        # Get a frame from the video source
-        ret, frame = self.vcap.read()
-
-        if ret:
-            self.canvas_width = self.canvas.winfo_width()
-            self.canvas_height = self.canvas.winfo_height()
-
-            frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-
-            # show current frame
-            pil_image = ImageOps.pad(Image.fromarray(frame), (self.canvas_width, self.canvas_height))
-            self.photo = ImageTk.PhotoImage(image=pil_image.transpose(Image.FLIP_LEFT_RIGHT))
-            self.canvas.create_image(self.canvas_width / 2, self.canvas_height / 2, image=self.photo)
-
-            # scan frame for ISBN
-            isbn = self.scan_isbn(frame)
-
-            # check existing books
-            if isbn in self.history:
-                ids = self.db.get_existing_pageid(isbn)
-                tags = []
-                for page_id in ids:
-                    pg = NotionPage(page_id)
-                    tags.append(pg.get_location_tag())
-                yesno = messagebox.askyesno(
-                    "Book already added",
-                    "This book already exists in database. "\
-                    "Do you want to update location tag?\n{}→{}".format(tags[0], self.loc_cmbbox.get()),
-                )
-                mode = "update" if yesno else "skip"
-            else:
-                mode = "add" if isbn is not None else "skip"
-
-            match mode:
-                case "add":
-                    self.upload_book(isbn)
-                case "update":
-                    pg = NotionPage(page_id=ids[0])
-                    pg.update_location(loc=self.loc_cmbbox.get())
-                case "skip":
-                    pass
-                case _:
-                    raise ValueError("Variable 'mode' has to be 'add', 'update' or 'skip'.")
+        try:
+            with self.profiler.section():
+                # Get the latest frame of displayed camera
+                worker = self.workers.get(self.current_cam)
+                frame = worker.get_frame() if worker else None
+
+                if frame is not None:
+                    self.canvas_width = self.canvas.winfo_width()
+                    self.canvas_height = self.canvas.winfo_height()
+
+                    # show current frame
+                    pil_image = ImageOps.pad(Image.fromarray(frame), (self.canvas_width, self.canvas_height))
+                    self.photo = ImageTk.PhotoImage(image=pil_image.transpose(Image.FLIP_LEFT_RIGHT))
+                    # reuse one canvas item so that items don't pile up over long runs
+                    if self.canvas_image is None:
+                        self.canvas_image = self.canvas.create_image(0, 0, image=self.photo)
+                    self.canvas.coords(self.canvas_image, self.canvas_width / 2, self.canvas_height / 2)
+                    self.canvas.itemconfigure(self.canvas_image, image=self.photo)
+                    self.cam_info_label.configure(text=worker.describe())
+
+                # ISBNs found by camera workers
+                detected = self.isbn_stream.drain()
+                self.station.prefetch([isbn for _, isbn in detected])
+
+            # handled outside the section, as dialogs wait for the user
+            for cam, isbn in detected:
+                self.station.handle_isbn(isbn, self.get_location(cam))
+        finally:
+            # keep scanning even if handling a book failed
+            self.after(self.delay, self.update_canvas)
+
+    def ask_update(self, isbn: int, tags: list[str], location: str, other_db: bool) -> bool:
+        """Method to ask whether to update the location of a book which already exists."""
+        return messagebox.askyesno(
+            "Book already added",
+            "This book already exists in database. "\
+            "Do you want to update location tag?\n{}→{}".format(tags[0], location)
+            + (
+                "\n'{}' belongs to another database and will be added to this book's database too.".format(location)
+                if other_db
+                else ""
+            ),
+        )
 
-        self.after(self.delay, self.update_canvas)
+    def show_failure(self, res):
+        """Method to show an error of Notion API, asking for a new API key if the current one is rejected."""
+        if res.status_code == 401:
+            self.set_api(prompt="Update API key of Notion:")
+        else:
+            messagebox.showerror(title=res.json()["code"], message=res.json()["code"] + "\n" + res.json()["message"])
+
+    def start_camera(self, index: int):
+        """Method to start capturing with given camera."""
+        if index not in self.workers:
+            worker = CameraWorker(
+                index,
+                self.isbn_stream,
+                profile=self.cam_profiles.get(index),
+                vcap=self.replayer.capture(index) if self.replayer else None,
+                recorder=self.recorder,
+            )
+            if not worker.is_opened():
+                print("Camera {} is not available. Its profile will be probed again on next launch.".format(index))
+                worker.stop()
+                if not self.replayer:
+                    invalidate_profiles(CAMERA_PROFILES)
+                return
+            print("Camera {}: {}".format(index, worker.describe()))
+            worker.start()
+            self.workers[index] = worker
+
+    def stop_camera(self, index: int):
+        """Method to stop capturing with given camera."""
+        worker = self.workers.pop(index, None)
+        if worker:
+            worker.stop()
+
+    def toggle_camera(self, index: int):
+        """Callback of camera checkboxes."""
+        if self.cam_checkbox[index].get():
+            self.start_camera(index)
+            if index not in self.workers:
+                self.cam_checkbox[index].deselect()
+        elif index != self.current_cam:
+            self.stop_camera(index)
+        else:
+            # displayed camera keeps running
+            self.cam_checkbox[index].select()
 
     def switch_source(self, value: str):
+        """Method to change the displayed camera. The location combobox follows the camera."""
         video_src = 0
         for c in value:
             if c.isdigit():
                 video_src = int(c)
                 break
-        self.vcap.release()
-        self.vcap = cv2.VideoCapture(video_src)
-        self.vwidth = self.vcap.get(cv2.CAP_PROP_FRAME_WIDTH)
-        self.vheight = self.vcap.get(cv2.CAP_PROP_FRAME_HEIGHT)
-
-    def upload_book(self, isbn: int):
+        self.start_camera(video_src)
+        if video_src not in self.workers:
+            messagebox.showerror("Camera unavailable", "Failed to open camera {}.".format(video_src))
+            self.cam_cmbbox.set(f"Camera {self.current_cam}")
+            return
+        self.current_cam = video_src
+        self.cam_checkbox[video_src].select()
+        self.vwidth = self.workers[video_src].vwidth
+        self.vheight = self.workers[video_src].vheight
+        self.loc_cmbbox.set(self.get_location(video_src))
+
+    def get_location(self, cam: int) -> str:
+        """Method to get location tag assigned to given camera."""
+        return self.cam_location.get(cam, self.loc_choice[0] if self.loc_choice else "")
+
+    def set_location(self, value: str):
+        """Method to assign location tag to displayed camera."""
+        self.cam_location[self.current_cam] = value
+
+    def on_close(self):
+        """Method to stop camera workers before closing the window."""
+        for index in list(self.workers):
+            self.stop_camera(index)
+        self.station.shutdown()
+        print("HTTP cache: {}".format(http_cache.stats()))
+        self.profiler.stop_profile()
+        self.profiler.stop_sampling()
+        if self.recorder:
+            self.recorder.stop()
+        if self.replayer:
+            self.replayer.stop()
+        self.destroy()
+
+    def confirm_upload(self, bookdata: dict) -> bool:
         """
-        Method to upload given book (ISBN) to Notion database.
+        Method to ask whether to upload the book, showing its cover.
+        The cover is loaded in background and shown when it arrives.
 
         Parameters
         ----------
-        isbn: int
-        """
-        bookdata = search_isbn(isbn)
-
-        if bookdata:
-            bookdata["location"] = self.loc_cmbbox.get()
-            print(bookdata)
-            conf = messagebox.askokcancel("Confirmation", "Upload '{}'?".format(bookdata["title"]))
-            if conf:
-                res = self.db.create_book_page(**bookdata)
-                if res.status_code == 200:
-                    print("Successfully added.")
-                    self.history.append(isbn)
-                elif res.status_code == 401:
-                    self.set_api(prompt="Update API key of Notion:")
-                else:
-                    print("Request failed.")
-                    print(res.json())
-                    messagebox.showerror(
-                        title=res.json()["code"],
-                        message=res.json()["code"] + "\n" + res.json()["message"]
-                    )
-                
-        else:
-            messagebox.showerror(message="No book found for ISBN: {}".format(isbn))
+        bookdata: dict
+            Information about the book.
 
-    def scan_isbn(self, frame) -> int | None:
+        Returns
+        -------
+        conf: bool
+            `True` if OK was pressed.
         """
-        Method to scan ISBN barcode in given frame.
-
-        Parameters
-        ----------
-        frame: numpy.ndarray
-
-        Return
-        ------
-        isbn: int | None
-            ISBN value found in the frame.
-        """
-        isbn = None
-        for barcode in decode(frame):
-            value = barcode.data.decode("utf-8")
-            if is_valid_ISBN(value):
-                isbn = int(value)
-                break
-        return isbn
+        result = {"conf": False}
+        dialog = ctk.CTkToplevel(self)
+        dialog.title("Confirmation")
+        dialog.transient(self)
+
+        cover_label = ctk.CTkLabel(dialog, text="No image", width=self.covers.size[0], height=self.covers.size[1])
+        text_label = ctk.CTkLabel(
+            dialog,
+            text="Upload '{}'?\n{}".format(bookdata["title"], ", ".join(bookdata["authors"] or [])),
+            font=ctk.CTkFont(size=16),
+            wraplength=320,
+        )
+        button_frame = ctk.CTkFrame(dialog, fg_color="transparent")
+
+        def close(conf: bool):
+            result["conf"] = conf
+            dialog.destroy()
+
+        ok_button = ctk.CTkButton(button_frame, text="OK", width=100, command=lambda: close(True))
+        cancel_button = ctk.CTkButton(button_frame, text="Cancel", width=100, command=lambda: close(False))
+
+        cover_label.pack(side="left", padx=20, pady=20)
+        text_label.pack(padx=20, pady=20)
+        button_frame.pack(side="bottom", pady=10)
+        ok_button.pack(side="left", padx=5)
+        cancel_button.pack(side="left", padx=5)
+
+        # show cover once it is in the cache
+        url = bookdata["thumbnail_link"]
+        future = self.covers.prefetch(url)
+
+        def show_cover():
+            if not dialog.winfo_exists():
+                return
+            image = self.covers.get(url)
+            if image is not None:
+                cover_label.configure(image=ctk.CTkImage(light_image=image, size=image.size), text="")
+            elif future is not None and not future.done():
+                dialog.after(100, show_cover)
+
+        if url:
+            show_cover()
+
+        dialog.protocol("WM_DELETE_WINDOW", lambda: close(False))
+        dialog.grab_set()
+        ok_button.focus_set()
+        self.wait_window(dialog)
+        return result["conf"]
 
     def create_dotenv(self):
         """Method to create .env file initially."""
@@ -336,13 +496,25 @@ class App(ctk.CTk):
         if input:
             item = input.split()[0]
             if not item in self.loc_choice:
+                try:
+                    self.library.add_location(item)
+                except ValueError as e:
+                    print(e)
+                    messagebox.showwarning("Location not saved", "Failed to add '{}' to database.".format(item))
                 self.loc_choice.append(item)
             self.loc_cmbbox.configure(values=self.loc_choice)
             self.loc_cmbbox.set(item)
+            self.set_location(item)
 
         print("Current locations: {}".format(self.loc_choice))
 
 
 if __name__ == "__main__":
-    app = App()
+    parser = argparse.ArgumentParser(description="Notion Book Stock")
+    parser.add_argument("--record", metavar="DIR", help="record camera frames and HTTP exchanges into DIR")
+    parser.add_argument("--replay", metavar="DIR", help="replay a session recorded in DIR")
+    parser.add_argument("--speed", type=float, default=1.0, help="speed of replay (0: as fast as possible)")
+    args = parser.parse_args()
+
+    app = App(record=args.record, replay=args.replay, speed=args.speed)
     app.mainloop()
@@ -0,0 +1,348 @@
+# Capture and decode barcodes from several cameras concurrently.
+import json
+import os
+import queue
+import threading
+import time
+
+import cv2
+from pyzbar.pyzbar import decode
+
+
+def is_valid_ISBN(value: str) -> bool:
+    """Function to validate if a given str is ISBN."""
+    try:
+        int(value)
+        if len(value) == 13:
+            return value[0:3] == "978" or value[0:3] == "979"
+        elif len(value) == 10:
+            return True
+        else:
+            return False
+    except:
+        return False
+
+
+def scan_isbn(frame) -> int | None:
+    """
+    Function to scan ISBN barcode in given frame.
+
+    Parameters
+    ----------
+    frame: numpy.ndarray
+
+    Return
+    ------
+    isbn: int | None
+        ISBN value found in the frame.
+    """
+    isbn = None
+    for barcode in decode(frame):
+        value = barcode.data.decode("utf-8")
+        if is_valid_ISBN(value):
+            isbn = int(value)
+            break
+    return isbn
+
+
+# candidate settings tried by `probe_camera`, in order of preference
+CANDIDATE_FOURCC = ["MJPG", "YUYV"]
+CANDIDATE_RESOLUTION = [(1920, 1080), (1280, 720), (800, 600), (640, 480)]
+MIN_HEIGHT = 480  # enough pixels for EAN-13 bars
+
+
+def fourcc_to_str(value: float) -> str:
+    """Function to convert FOURCC code returned by `cv2.VideoCapture.get` into str."""
+    value = int(value)
+    return "".join(chr((value >> 8 * i) & 0xFF) for i in range(4))
+
+
+def measure_fps(vcap: cv2.VideoCapture, n_frames: int = 10) -> float:
+    """Function to measure actual frame rate of a capture."""
+    for _ in range(2):  # warm up
+        vcap.read()
+    start = time.perf_counter()
+    n = 0
+    for _ in range(n_frames):
+        ret, _ = vcap.read()
+        if ret:
+            n += 1
+    elapsed = time.perf_counter() - start
+    return n / elapsed if elapsed > 0 else 0.0
+
+
+def apply_profile(vcap: cv2.VideoCapture, profile: dict):
+    """
+    Function to apply a device profile to a capture.
+
+    Parameters
+    ----------
+    vcap: cv2.VideoCapture
+    profile: dict
+        Profile made by `probe_camera`.
+    """
+    vcap.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*profile["fourcc"]))
+    vcap.set(cv2.CAP_PROP_FRAME_WIDTH, profile["width"])
+    vcap.set(cv2.CAP_PROP_FRAME_HEIGHT, profile["height"])
+    if profile.get("fps"):
+        vcap.set(cv2.CAP_PROP_FPS, profile["fps"])
+
+
+def probe_camera(index: int) -> dict | None:
+    """
+    Function to find the best settings of a camera for decoding barcodes.
+    Each candidate FOURCC and resolution is requested, and the settings accepted by the driver are measured.
+    Among settings with enough pixels, the one with highest frame rate (then more pixels) is chosen.
+
+    Parameters
+    ----------
+    index: int
+        Index of camera.
+
+    Returns
+    -------
+    profile: dict | None
+        `profile` has following keys: `index`, `fourcc`, `width`, `height`, `fps` and `measured_fps`.
+        Returns `None` if the camera cannot be opened.
+    """
+    vcap = cv2.VideoCapture(index)
+    if vcap is None or not vcap.isOpened():
+        return None
+
+    tried = set()
+    best = None
+    try:
+        for fourcc in CANDIDATE_FOURCC:
+            for width, height in CANDIDATE_RESOLUTION:
+                vcap.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*fourcc))
+                vcap.set(cv2.CAP_PROP_FRAME_WIDTH, width)
+                vcap.set(cv2.CAP_PROP_FRAME_HEIGHT, height)
+                profile = dict(
+                    index=index,
+                    fourcc=fourcc_to_str(vcap.get(cv2.CAP_PROP_FOURCC)),
+                    width=int(vcap.get(cv2.CAP_PROP_FRAME_WIDTH)),
+                    height=int(vcap.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+                    fps=vcap.get(cv2.CAP_PROP_FPS),
+                )
+                key = (profile["fourcc"], profile["width"], profile["height"])
+                if key in tried:
+                    continue  # driver fell back to a setting already measured
+                tried.add(key)
+                profile["measured_fps"] = round(measure_fps(vcap), 1)
+                print("Camera {}: {}x{} {} {:.1f}fps".format(index, *key[1:], key[0], profile["measured_fps"]))
+
+                score = (profile["height"] >= MIN_HEIGHT, profile["measured_fps"], profile["width"] * profile["height"])
+                if best is None or score > best[0]:
+                    best = (score, profile)
+    finally:
+        vcap.release()
+
+    return best[1] if best else None
+
+
+def load_profiles(filename: str) -> dict[int, dict] | None:
+    """Function to load cached device profiles. Returns `None` if there is no cache."""
+    try:
+        with open(filename, "r") as f:
+            return {int(k): v for k, v in json.load(f).items()}
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+def save_profiles(filename: str, profiles: dict[int, dict]):
+    """Function to cache device profiles."""
+    with open(filename, "w") as f:
+        json.dump(profiles, f, indent=4)
+
+
+def invalidate_profiles(filename: str):
+    """Function to delete cached device profiles so that cameras are probed on next launch."""
+    if os.path.exists(filename):
+        os.remove(filename)
+
+
+def is_camera_present(index: int) -> bool:
+    """Function to check if a camera can be opened, without negotiating settings."""
+    vcap = cv2.VideoCapture(index)
+    try:
+        return vcap is not None and vcap.isOpened()
+    finally:
+        vcap.release()
+
+
+def get_profiles(filename: str = "camera_profiles.json", max_cameras: int = 5) -> dict[int, dict]:
+    """
+    Function to get profiles of available cameras.
+    Every index is checked on each launch by opening it. Cached profiles are reused for cameras still present,
+    and only cameras without a cached profile are probed; delete the cache file to probe all of them again.
+
+    Parameters
+    ----------
+    filename: str
+        Path of cache file.
+    max_cameras: int
+        Number of camera indexes to check.
+
+    Returns
+    -------
+    profiles: dict[int, dict]
+        Profiles of available cameras, keyed by camera index.
+    """
+    cached = load_profiles(filename) or {}
+    profiles = {}
+    probed = set()
+    for i in range(max_cameras):
+        print(f"Checking camera {i} is available...")
+        if not is_camera_present(i):
+            continue
+        if i in cached:
+            profiles[i] = cached[i]
+            continue
+        profile = probe_camera(i)
+        if profile is None:
+            continue
+        profiles[i] = cached[i] = profile
+        probed.add(i)
+    if probed:
+        # profiles of absent cameras are kept for when they are plugged in again
+        save_profiles(filename, cached)
+    reused = sorted(set(profiles) - probed)
+    if reused:
+        print("Reused camera profiles from '{}' for cameras {}".format(filename, reused))
+    return profiles
+
+
+class ISBNStream:
+    """
+    Class for collecting ISBNs detected by camera workers.
+
+    The same book stays in front of a camera for many frames, and may be seen by several cameras.
+    An ISBN is queued only if no camera has seen it within `cooldown` seconds.
+    """
+
+    def __init__(self, cooldown: float = 3.0) -> None:
+        self.cooldown = cooldown
+        self.queue = queue.Queue()
+        self.last_seen = {}
+        self.lock = threading.Lock()
+
+    def put(self, cam: int, isbn: int):
+        """
+        Method to report a detection.
+
+        Parameters
+        ----------
+        cam: int
+            Index of camera which saw the book.
+        isbn: int
+        """
+        now = time.monotonic()
+        with self.lock:
+            last = self.last_seen.get(isbn)
+            self.last_seen[isbn] = now
+            if len(self.last_seen) > 1024:
+                # forget books not seen recently
+                self.last_seen = {k: t for k, t in self.last_seen.items() if now - t <= self.cooldown}
+        if last is None or now - last > self.cooldown:
+            print("Camera {} detected ISBN {}".format(cam, isbn))
+            self.queue.put((cam, isbn))
+
+    def drain(self) -> list[tuple[int, int]]:
+        """Method to get all queued detections as (camera index, ISBN) without blocking."""
+        items = []
+        while True:
+            try:
+                items.append(self.queue.get_nowait())
+            except queue.Empty:
+                return items
+
+
+class CameraWorker(threading.Thread):
+    """
+    Thread for capturing frames from one camera and decoding barcodes in them.
+    OpenCV and zbar release the GIL while working, so each camera runs on its own core.
+    """
+
+    def __init__(
+        self, index: int, stream: ISBNStream, profile: dict | None = None, vcap=None, recorder=None
+    ) -> None:
+        """
+        Parameters
+        ----------
+        index: int
+            Index of camera.
+        stream: ISBNStream
+            Stream to report detected ISBNs to.
+        profile: dict | None
+            Device profile made by `probe_camera`.
+        vcap: cv2.VideoCapture | None
+            Capture to read frames from instead of the camera, e.g. `ReplayCapture`.
+        recorder: SessionRecorder | None
+            Recorder of captured frames.
+        """
+        super().__init__(name="camera-{}".format(index), daemon=True)
+        self.index = index
+        self.stream = stream
+        self.profile = profile
+        self.recorder = recorder
+        self.vcap = vcap if vcap is not None else cv2.VideoCapture(index)
+        if profile:
+            apply_profile(self.vcap, profile)
+        self.fps = 0.0
+        self.vwidth = self.vcap.get(cv2.CAP_PROP_FRAME_WIDTH)
+        self.vheight = self.vcap.get(cv2.CAP_PROP_FRAME_HEIGHT)
+        # read once here; VideoCapture must not be used from other threads once `run` starts
+        self.fourcc = fourcc_to_str(self.vcap.get(cv2.CAP_PROP_FOURCC))
+        self.frame = None
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+
+    def run(self):
+        last = time.perf_counter()
+        try:
+            while not self.stop_event.is_set():
+                ret, frame = self.vcap.read()
+                if not ret:
+                    time.sleep(0.01)
+                    continue
+                if self.recorder:
+                    self.recorder.record_frame(self.index, frame)
+                now = time.perf_counter()
+                self.fps = 0.9 * self.fps + 0.1 / max(now - last, 1e-6)
+                last = now
+                frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+                with self.lock:
+                    self.frame = frame
+                isbn = scan_isbn(frame)
+                if isbn is not None:
+                    self.stream.put(self.index, isbn)
+        finally:
+            self.vcap.release()
+
+    def get_frame(self):
+        """Method to get the latest RGB frame. Returns `None` before the first frame arrives."""
+        with self.lock:
+            return self.frame
+
+    def is_opened(self) -> bool:
+        """Method to check if the camera could be opened."""
+        return self.vcap.isOpened()
+
+    def describe(self) -> str:
+        """Method to get a short description of capture settings and measured frame rate."""
+        return "{}x{} {} {:.1f}fps".format(int(self.vwidth), int(self.vheight), self.fourcc, self.fps)
+
+    def stop(self, timeout: float = 2.0):
+        """
+        Method to stop capturing and wait until the thread releases the camera.
+
+        Parameters
+        ----------
+        timeout: float
+            Maximum time to wait in seconds.
+        """
+        self.stop_event.set()
+        if self.is_alive():
+            self.join(timeout)
+        else:
+            self.vcap.release()
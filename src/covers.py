@@ -0,0 +1,165 @@
+# Cache of book cover thumbnails.
+import hashlib
+import io
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import requests
+from PIL import Image
+
+
+class CoverCache:
+    """
+    Class for downloading and caching cover thumbnails in background.
+
+    Source files which could be decoded are kept on disk under `cache_dir` up to `max_disk_bytes`, and decoded
+    images resized to fit `size` are kept in memory up to `max_bytes`, evicting least recently used ones in both.
+    Concurrent requests for the same URL share one download.
+    """
+
+    def __init__(
+        self,
+        cache_dir: str = ".covers",
+        size: tuple[int, int] = (128, 192),
+        max_bytes: int = 32 * 1024 * 1024,
+        max_disk_bytes: int = 64 * 1024 * 1024,
+        timeout: float = 5.0,
+    ) -> None:
+        """
+        Parameters
+        ----------
+        cache_dir: str
+            Directory of downloaded files.
+        size: tuple[int, int]
+            Maximum width and height of cached images.
+        max_bytes: int
+            Memory limit of decoded images.
+        max_disk_bytes: int
+            Disk limit of downloaded files.
+        timeout: float
+            Timeout of a download in seconds.
+        """
+        self.cache_dir = cache_dir
+        self.size = size
+        self.max_bytes = max_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self.timeout = timeout
+        self.images = OrderedDict()
+        self.nbytes = 0
+        self.in_flight = {}
+        self.lock = threading.Lock()
+        self.disk_lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="covers")
+        self.session = requests.Session()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def get(self, url: str) -> Image.Image | None:
+        """Method to get a cached image without blocking. Returns `None` if it is not loaded yet."""
+        with self.lock:
+            image = self.images.get(url)
+            if image is not None:
+                self.images.move_to_end(url)
+            return image
+
+    def prefetch(self, url: str | None) -> Future | None:
+        """
+        Method to start loading an image in background.
+
+        Parameters
+        ----------
+        url: str | None
+            URL of the image.
+
+        Returns
+        -------
+        future: Future | None
+            Future of the resized image, which is `None` if loading failed.
+        """
+        if not url:
+            return None
+        with self.lock:
+            if url in self.images:
+                future = Future()
+                future.set_result(self.images[url])
+                return future
+            if url in self.in_flight:
+                return self.in_flight[url]
+            future = self.executor.submit(self.load, url)
+            self.in_flight[url] = future
+        return future
+
+    def load(self, url: str) -> Image.Image | None:
+        """
+        Method to read the source file from disk or network, and decode and resize it.
+        Downloaded files are saved only after they are decoded, and cached files which cannot be decoded are deleted.
+        """
+        path = os.path.join(self.cache_dir, hashlib.sha1(url.encode("utf-8")).hexdigest())
+        image = None
+        try:
+            cached = os.path.exists(path)
+            if cached:
+                with open(path, "rb") as f:
+                    data = f.read()
+                os.utime(path)  # mark as recently used
+            else:
+                res = self.session.get(url, timeout=self.timeout)
+                res.raise_for_status()
+                data = res.content
+
+            try:
+                image = self.decode(data)
+            except (OSError, Image.DecompressionBombError) as e:
+                print("Failed to decode cover '{}': {}".format(url, e))
+                if cached:
+                    os.remove(path)
+            else:
+                if not cached:
+                    tmp = path + ".tmp"
+                    with open(tmp, "wb") as f:
+                        f.write(data)
+                    os.replace(tmp, path)
+                    self.evict_disk()
+        except (requests.RequestException, OSError) as e:
+            print("Failed to load cover '{}': {}".format(url, e))
+
+        with self.lock:
+            if image is not None:
+                self.put(url, image)
+            self.in_flight.pop(url, None)
+        return image
+
+    def decode(self, data: bytes) -> Image.Image:
+        """Method to decode an image and resize it to fit `size`."""
+        image = Image.open(io.BytesIO(data))
+        image.thumbnail(self.size)
+        return image.convert("RGB")
+
+    def evict_disk(self):
+        """Method to delete least recently used files while the cache directory exceeds `max_disk_bytes`."""
+        with self.disk_lock:
+            files = []
+            for entry in os.scandir(self.cache_dir):
+                if entry.is_file() and not entry.name.endswith(".tmp"):
+                    stat = entry.stat()
+                    files.append((stat.st_mtime, stat.st_size, entry.path))
+            total = sum(size for _, size, _ in files)
+            for _, size, path in sorted(files):
+                if total <= self.max_disk_bytes:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+
+    def put(self, url: str, image: Image.Image):
+        """Method to add an image to memory, evicting old ones over `max_bytes`. Called with `lock` held."""
+        nbytes = image.width * image.height * len(image.getbands())
+        if url not in self.images:
+            self.images[url] = image
+            self.nbytes += nbytes
+        while self.nbytes > self.max_bytes and len(self.images) > 1:
+            _, old = self.images.popitem(last=False)
+            self.nbytes -= old.width * old.height * len(old.getbands())
@@ -1,4 +1,4 @@
-import requests
+from src.http_cache import http_cache
 
 def get_latest_tag(repo_owner: str, repo_name: str) -> str | None:
     """
@@ -17,7 +17,8 @@ def get_latest_tag(repo_owner: str, repo_name: str) -> str | None:
         Name of latest tag. Returns `None` if no tags published.
     """
     api_url = f"https://api.github.com/repos/{repo_owner}/{repo_name}/releases/latest"
-    response = requests.get(api_url)
+    # revalidated with ETag, which doesn't count against the rate limit when unchanged
+    response = http_cache.get(api_url, timeout=10)
     if response.status_code == 200:
         data = response.json()
         latest_tag_name = data["tag_name"]
@@ -1,61 +1,187 @@
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import TypedDict
+
 import requests
 
-def copy_entry(
-        src_dict: dict, src_key: str,
-        dst_dict: dict, dst_key: str
-    ):
-    try:
-        dst_dict[dst_key] = src_dict[src_key]
-    except:
-        dst_dict[dst_key] = None
-        print("There is no key named '{}'".format(src_key))
-
-def search_isbn(isbn: int, verbose=False) -> dict | None:
-    """
-    Function to search ISBN value in Google Books.
 
-    Parameters
-    ----------
+class BookData(TypedDict):
+    """Information about a book. Keys match the arguments of `NotionDB.create_book_page` except `location`."""
+
     isbn: int
-    verbose: bool
+    title: str
+    authors: list[str] | None
+    published_date: str | None
+    description: str | None
+    thumbnail_link: str | None
 
-    Returns
-    -------
-    bookdata: dict | None
-        Information about the book.
+
+class GoogleBooksClient:
     """
-    url = "https://www.googleapis.com/books/v1/volumes?q=isbn:{}".format(isbn)
+    Class for looking up books in Google Books.
 
-    response = requests.get(url)
-    data = response.json()
+    Only the fields used by the app are requested, connections are reused with gzip enabled,
+    and every request has a timeout. If a request is slower than the `hedge_percentile` of recent
+    lookups, a second identical request is sent and whichever answers first is used.
+    """
+
+    url = "https://www.googleapis.com/books/v1/volumes"
+    fields = "totalItems,items(volumeInfo(title,authors,publishedDate,description,imageLinks/thumbnail))"
+
+    def __init__(
+        self,
+        timeout: tuple[float, float] = (3.05, 5.0),
+        hedge_percentile: float = 0.95,
+        hedge_delay: float = 1.0,
+        min_hedge_delay: float = 0.2,
+        window: int = 50,
+    ) -> None:
+        """
+        Parameters
+        ----------
+        timeout: tuple[float, float]
+            Connect and read timeout of each request in seconds.
+        hedge_percentile: float
+            Percentile of recent latencies after which a hedged request is sent.
+        hedge_delay: float
+            Delay before hedging until enough latencies are recorded.
+        min_hedge_delay: float
+            Lower bound of the delay before hedging.
+        window: int
+            Number of recent latencies to keep.
+        """
+        self.timeout = timeout
+        self.hedge_percentile = hedge_percentile
+        self.default_hedge_delay = hedge_delay
+        self.min_hedge_delay = min_hedge_delay
+        self.latencies = deque(maxlen=window)
+        self.local = threading.local()
+        self.executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="google-books")
+
+    @property
+    def session(self) -> requests.Session:
+        """Session of the current thread."""
+        if not hasattr(self.local, "session"):
+            session = requests.Session()
+            # Google APIs compress responses only if user agent contains "gzip"
+            session.headers.update({"Accept-Encoding": "gzip", "User-Agent": "notion-book-stock (gzip)"})
+            self.local.session = session
+        return self.local.session
+
+    def hedge_delay(self) -> float:
+        """Method to get current delay before sending a hedged request."""
+        if len(self.latencies) < 10:
+            return self.default_hedge_delay
+        sorted_latencies = sorted(self.latencies)
+        i = min(int(len(sorted_latencies) * self.hedge_percentile), len(sorted_latencies) - 1)
+        return max(sorted_latencies[i], self.min_hedge_delay)
 
-    if data["totalItems"] > 0:
-        volume_info = data["items"][0]["volumeInfo"]
-        bookdata = dict(
-            isbn            = int(isbn),
-            title           = volume_info["title"],
+    def fetch(self, isbn: int) -> dict:
+        """Method to send one request and return decoded JSON."""
+        start = time.perf_counter()
+        response = self.session.get(
+            self.url,
+            params={"q": "isbn:{}".format(isbn), "fields": self.fields},
+            timeout=self.timeout,
         )
-        copy_entry(volume_info, "authors",       bookdata, "authors")
-        copy_entry(volume_info, "publishedDate", bookdata, "published_date")
-        copy_entry(volume_info, "description",   bookdata, "description")
+        response.raise_for_status()
+        data = response.json()
+        self.latencies.append(time.perf_counter() - start)
+        return data
+
+    def fetch_hedged(self, isbn: int) -> dict:
+        """Method to send a request, and a second one if the first is slow. Returns the first successful response."""
+        futures = {self.executor.submit(self.fetch, isbn)}
+        done, _ = wait(futures, timeout=self.hedge_delay())
+        if not done:
+            print("Google Books is slow. Sending hedged request for ISBN '{}'".format(isbn))
+            futures.add(self.executor.submit(self.fetch, isbn))
+
+        error = None
+        while futures:
+            done, futures = wait(futures, return_when=FIRST_COMPLETED)
+            for f in done:
+                if f.exception() is None:
+                    for other in futures:
+                        other.cancel()
+                    return f.result()
+                error = f.exception()
+        raise error
+
+    def search_isbn(self, isbn: int, verbose=False) -> BookData | None:
+        """
+        Method to search ISBN value in Google Books.
+
+        Parameters
+        ----------
+        isbn: int
+        verbose: bool
+
+        Returns
+        -------
+        bookdata: BookData | None
+            Information about the book. Returns `None` if no book was found or the request failed.
+        """
         try:
-            copy_entry(volume_info["imageLinks"], "thumbnail", bookdata, "thumbnail_link")
-        except:
-            bookdata["thumbnail_link"] = None
+            data = self.fetch_hedged(isbn)
+        except (requests.RequestException, ValueError) as e:
+            print("Failed to search ISBN '{}' in Google Books.".format(isbn))
+            print(type(e))
+            print(e)
+            return None
 
+        bookdata = self.parse(isbn, data)
         if verbose:
-            print(bookdata)
+            if bookdata:
+                print(bookdata)
+            else:
+                print("No book was found for ISBN '{}'".format(isbn))
 
-    else:
-        bookdata = None
-        if verbose:
-            print("No book was found for ISBN '{}'".format(isbn))
-    
-    return bookdata
+        return bookdata
+
+    @staticmethod
+    def parse(isbn: int, data: dict) -> BookData | None:
+        """Method to convert a volumes response into `BookData`. Returns `None` if no book was found."""
+        if data.get("totalItems", 0) > 0 and data.get("items"):
+            volume_info = data["items"][0].get("volumeInfo", {})
+            return BookData(
+                isbn=int(isbn),
+                title=volume_info.get("title", ""),
+                authors=volume_info.get("authors"),
+                published_date=volume_info.get("publishedDate"),
+                description=volume_info.get("description"),
+                thumbnail_link=volume_info.get("imageLinks", {}).get("thumbnail"),
+            )
+        return None
+
+
+_client = None
+
+
+def search_isbn(isbn: int, verbose=False) -> BookData | None:
+    """
+    Function to search ISBN value in Google Books with a shared `GoogleBooksClient`.
+
+    Parameters
+    ----------
+    isbn: int
+    verbose: bool
+
+    Returns
+    -------
+    bookdata: BookData | None
+        Information about the book.
+    """
+    global _client
+    if _client is None:
+        _client = GoogleBooksClient()
+    return _client.search_isbn(isbn, verbose=verbose)
 
 
 if __name__ == "__main__":
-    
+
     # add a book into Notion database
     isbn = 9784537214192    # "The Wine"
-    print(search_isbn(isbn))
\ No newline at end of file
+    print(search_isbn(isbn))
@@ -0,0 +1,182 @@
+# Shared cache of GET responses with conditional requests.
+import base64
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import requests
+
+
+class HTTPCache:
+    """
+    Class for caching responses of read-mostly GET endpoints.
+
+    A cached response is reused without a request for `ttl` seconds. After that, it is revalidated with
+    `If-None-Match` / `If-Modified-Since` if the service returned `ETag` / `Last-Modified`
+    (e.g. GitHub), or fetched again otherwise (e.g. Notion).
+    Responses with validators are also saved to `filename`, so that they can be revalidated after restart.
+    """
+
+    def __init__(self, filename: str | None = None, max_entries: int = 1024) -> None:
+        """
+        Parameters
+        ----------
+        filename: str | None
+            Path of file to persist responses with validators. Nothing is saved if `None`.
+        max_entries: int
+            Number of responses to keep. Least recently used ones are dropped.
+        """
+        self.filename = filename
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.counts = {"hit": 0, "revalidated": 0, "miss": 0, "invalidated": 0}
+        if filename:
+            self.load()
+
+    @staticmethod
+    def make_key(url: str, headers: dict | None) -> str:
+        """Method to make cache key. Credentials are hashed so that responses of different users are separated."""
+        auth = (headers or {}).get("Authorization", "")
+        return url + "#" + hashlib.sha256(auth.encode("utf-8")).hexdigest()[:16]
+
+    def get(self, url: str, headers: dict | None = None, ttl: float = 0, **kwargs) -> requests.Response:
+        """
+        Method to send GET request through the cache.
+
+        Parameters
+        ----------
+        url: str
+        headers: dict | None
+        ttl: float
+            Seconds to reuse the response without asking the server.
+        **kwargs
+            Passed to `requests.get`.
+
+        Returns
+        -------
+        response: requests.Response
+        """
+        key = self.make_key(url, headers)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry:
+                self.entries.move_to_end(key)
+
+        if entry and time.time() - entry["stored_at"] < ttl:
+            self.count("hit")
+            return entry["response"]
+
+        req_headers = dict(headers or {})
+        if entry:
+            etag = entry["response"].headers.get("ETag")
+            last_modified = entry["response"].headers.get("Last-Modified")
+            if etag:
+                req_headers["If-None-Match"] = etag
+            if last_modified:
+                req_headers["If-Modified-Since"] = last_modified
+
+        response = requests.get(url, headers=req_headers, **kwargs)
+
+        if response.status_code == 304 and entry:
+            self.count("revalidated")
+            with self.lock:
+                entry["stored_at"] = time.time()
+            return entry["response"]
+        if response.status_code == 304:
+            # nothing to reuse (e.g. a replayed 304 recorded with another cache); ask for the body
+            response = requests.get(url, headers=headers, **kwargs)
+
+        self.count("miss")
+        if response.status_code == 200:
+            with self.lock:
+                self.entries[key] = {"response": response, "stored_at": time.time()}
+                self.entries.move_to_end(key)
+                while len(self.entries) > self.max_entries:
+                    self.entries.popitem(last=False)
+            if self.filename and ("ETag" in response.headers or "Last-Modified" in response.headers):
+                self.save()
+        return response
+
+    def invalidate(self, url: str):
+        """
+        Method to drop cached responses of URLs starting with `url`. Called after writes to the resource.
+        """
+        with self.lock:
+            keys = [k for k in self.entries if k.startswith(url)]
+            for k in keys:
+                del self.entries[k]
+        if keys:
+            self.count("invalidated", len(keys))
+
+    def isolate(self):
+        """
+        Method to stop persisting responses and drop ones loaded from `filename`,
+        so that requests do not depend on earlier runs, e.g. while recording or replaying a session.
+        """
+        with self.lock:
+            self.filename = None
+            self.entries.clear()
+
+    def count(self, name: str, n: int = 1):
+        with self.lock:
+            self.counts[name] += n
+
+    def stats(self) -> dict:
+        """
+        Method to get statistics.
+
+        Returns
+        -------
+        stats: dict
+            Numbers of `hit`, `revalidated` (304), `miss` and `invalidated`, and `hit_rate`.
+        """
+        with self.lock:
+            stats = dict(self.counts)
+        total = stats["hit"] + stats["revalidated"] + stats["miss"]
+        stats["hit_rate"] = (stats["hit"] + stats["revalidated"]) / total if total else 0.0
+        return stats
+
+    def load(self):
+        """Method to read persisted responses."""
+        try:
+            with open(self.filename, "r") as f:
+                data = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return
+        for key, item in data.items():
+            response = requests.Response()
+            response.status_code = item["status_code"]
+            response.url = item["url"]
+            response.headers.update(item["headers"])
+            response._content = base64.b64decode(item["content"])
+            response.encoding = item["encoding"]
+            # persisted responses are always revalidated first
+            self.entries[key] = {"response": response, "stored_at": 0.0}
+
+    def save(self):
+        """Method to persist responses with validators."""
+        with self.lock:
+            data = {}
+            for key, entry in self.entries.items():
+                res = entry["response"]
+                if "ETag" not in res.headers and "Last-Modified" not in res.headers:
+                    continue
+                data[key] = {
+                    "status_code": res.status_code,
+                    "url": res.url,
+                    "headers": {k: v for k, v in res.headers.items() if k in ("ETag", "Last-Modified", "Content-Type")},
+                    "content": base64.b64encode(res.content).decode("ascii"),
+                    "encoding": res.encoding,
+                }
+        tmp = self.filename + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(data, f)
+        os.replace(tmp, self.filename)
+
+
+# cache shared by API clients
+http_cache = HTTPCache(filename=".http_cache.json")
@@ -0,0 +1,198 @@
+# Manage several Notion book databases at once.
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from src.notion import NotionDB
+from src.snapshot import load_isbn_list
+
+
+class Library:
+    """
+    Class for handling several Notion book databases as one.
+
+    Databases are synchronized in parallel, so startup takes about as long as the slowest database,
+    or only as long as reading the previous snapshots while they are refreshed in background.
+    ISBNs of all databases are kept in one index for duplicate checks. New books go to the database
+    which owns their location tag. The owner of a tag is the database it was first seen in, recorded in `filename`,
+    so that options Notion creates in other databases (e.g. by relocating a book to a tag of another database)
+    don't change routing.
+    """
+
+    def __init__(self, database_ids: list[str], filename: str | None = "locations.json") -> None:
+        """
+        Parameters
+        ----------
+        database_ids: list[str]
+            IDs of databases. The first one receives locations which don't exist in any database yet.
+        filename: str | None
+            Path of file to record owners of location tags. Nothing is recorded if `None`.
+        """
+        assert len(database_ids) > 0, "No database is specified."
+        self.dbs = {db_id: NotionDB(databse_id=db_id) for db_id in database_ids}
+        self.default_db = database_ids[0]
+        self.filename = filename
+        self.index = {}
+        self.added = {}  # ISBNs added by this app, for each database
+        self.lock = threading.Lock()
+        self.refresher = None
+        self.location_db = self.load_owners()
+
+    def validate(self):
+        """Method to validate schemas of all databases. Raises `ValueError` listing invalid databases."""
+        errors = []
+        for db_id, db in self.dbs.items():
+            try:
+                db.schema.validate()
+            except ValueError as e:
+                errors.append("{}: {}".format(db_id, e))
+        if errors:
+            raise ValueError("\n".join(errors))
+
+    def sync(self, background: bool = True):
+        """
+        Method to fetch ISBNs and location tags of all databases in parallel.
+
+        Parameters
+        ----------
+        background: bool
+            If `True` and every database has a complete snapshot from an earlier run, ISBNs are loaded
+            from those snapshots, and the snapshots are exported again in background with `refresh`.
+            Otherwise databases are exported before returning.
+        """
+        cached = all(os.path.exists(self.snapshot_filename(db_id)) for db_id in self.dbs)
+        with ThreadPoolExecutor(max_workers=2 * len(self.dbs), thread_name_prefix="sync") as executor:
+            tags = executor.map(lambda db: db.get_location_tags(), self.dbs.values())
+            if background and cached:
+                isbns = {db_id: load_isbn_list(self.snapshot_filename(db_id)) for db_id in self.dbs}
+            else:
+                isbns = dict(zip(self.dbs, executor.map(self.export, self.dbs.values())))
+            locations = dict(zip(self.dbs, tags))
+
+        self.set_index(isbns)
+        found = {}  # location -> databases having it, in configured order
+        for db_id in self.dbs:
+            for loc in locations[db_id]:
+                found.setdefault(loc, []).append(db_id)
+            print("Database {}: {} books, {} locations".format(db_id, len(isbns[db_id]), len(locations[db_id])))
+
+        owners = self.location_db
+        self.location_db = {}
+        for loc, db_ids in found.items():
+            owner = owners.get(loc)
+            if owner not in db_ids:
+                owner = db_ids[0]
+            self.location_db[loc] = owner
+            if len(db_ids) > 1:
+                print("Location '{}' exists in databases {}. New books go to {}.".format(loc, db_ids, owner))
+        self.save_owners()
+
+        if background and cached:
+            self.refresher = threading.Thread(target=self.refresh, name="library-refresh", daemon=True)
+            self.refresher.start()
+
+    def refresh(self):
+        """Method to export all databases again and replace the ISBN index. Books added meanwhile are kept."""
+        try:
+            with ThreadPoolExecutor(max_workers=len(self.dbs), thread_name_prefix="refresh") as executor:
+                isbns = dict(zip(self.dbs, executor.map(self.export, self.dbs.values())))
+        except Exception as e:
+            print("Failed to refresh snapshots: {}".format(e))
+            return
+        self.set_index(isbns)
+        print("Refreshed snapshots: {} books".format(len(self.index)))
+
+    def snapshot_filename(self, db_id: str) -> str:
+        return "bookdata-{}.jsonl.gz".format(db_id)
+
+    def export(self, db: NotionDB) -> list[int]:
+        """Method to export a database into its snapshot and get its ISBNs."""
+        snapshot = db.export_snapshot(filename=self.snapshot_filename(db.database_id))
+        return load_isbn_list(snapshot.filename)
+
+    def set_index(self, isbns: dict[str, list[int]]):
+        """Method to replace the ISBN index with ISBNs of each database, keeping books added by this app."""
+        index = {}
+        for db_id, values in isbns.items():
+            for isbn in values:
+                index.setdefault(isbn, set()).add(db_id)
+        with self.lock:
+            for db_id, values in self.added.items():
+                for isbn in values:
+                    index.setdefault(isbn, set()).add(db_id)
+            self.index = index
+
+    def __contains__(self, isbn: int) -> bool:
+        return isbn in self.index
+
+    def get_locations(self) -> list[str]:
+        """Method to get location tags of all databases."""
+        return list(self.location_db)
+
+    def db_for_location(self, loc: str) -> NotionDB:
+        """Method to get the database which new books at given location go to."""
+        return self.dbs[self.location_db.get(loc, self.default_db)]
+
+    def add_location(self, loc: str, database_id: str | None = None):
+        """
+        Method to add a location tag to a database.
+
+        Parameters
+        ----------
+        loc: str
+            Name of new location tag.
+        database_id: str | None
+            Database which the location belongs to. The first database if `None`.
+        """
+        db_id = database_id or self.default_db
+        self.dbs[db_id].add_location_tag(loc)
+        if loc not in self.location_db:
+            self.location_db[loc] = db_id
+            self.save_owners()
+
+    def load_owners(self) -> dict[str, str]:
+        """Method to read recorded owners of location tags."""
+        if not self.filename:
+            return {}
+        try:
+            with open(self.filename, "r") as f:
+                owners = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+        return {loc: db_id for loc, db_id in owners.items() if db_id in self.dbs}
+
+    def save_owners(self):
+        """Method to record owners of location tags."""
+        if self.filename:
+            with open(self.filename, "w") as f:
+                json.dump(self.location_db, f, indent=4, ensure_ascii=False)
+
+    def get_existing_pageid(self, isbn: int) -> list[tuple[NotionDB, str]]:
+        """
+        Method to get existing pages of the book in all databases which have it.
+
+        Returns
+        -------
+        pages: list[tuple[NotionDB, str]]
+            Pairs of database and page id, in configured order of databases.
+        """
+        db_ids = self.index.get(isbn, set())
+        pages = []
+        for db_id, db in self.dbs.items():
+            if db_id in db_ids:
+                pages += [(db, page_id) for page_id in db.get_existing_pageid(isbn)]
+        return pages
+
+    def create_book_page(self, **bookdata):
+        """Method to add a book to the database of its location. See `NotionDB.create_book_page`."""
+        db = self.db_for_location(bookdata["location"])
+        res = db.create_book_page(**bookdata)
+        if res.status_code == 200:
+            with self.lock:
+                self.index.setdefault(bookdata["isbn"], set()).add(db.database_id)
+                self.added.setdefault(db.database_id, set()).add(bookdata["isbn"])
+            if bookdata["location"] and bookdata["location"] not in self.location_db:
+                self.location_db[bookdata["location"]] = db.database_id
+                self.save_owners()
+        return res
@@ -0,0 +1,269 @@
+# Resolve book metadata from several providers in parallel.
+import re
+import threading
+import time
+import xml.etree.ElementTree as ET
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import requests
+
+from src.google_books import BookData, GoogleBooksClient
+
+FIELDS = ["title", "authors", "published_date", "description", "thumbnail_link"]
+
+
+def normalize_date(value: str | None) -> str | None:
+    """
+    Function to convert dates such as `20180115`, `2018.1` or `2018-01` into ISO 8601 (`2018-01-15`, `2018-01`).
+    """
+    if not value:
+        return None
+    nums = re.findall(r"\d+", value)
+    if not nums:
+        return None
+    if len(nums) == 1 and len(nums[0]) in (6, 8):
+        nums = [nums[0][0:4], nums[0][4:6], nums[0][6:8]]
+    parts = [nums[0][:4]] + ["{:02d}".format(int(n)) for n in nums[1:3] if n]
+    return "-".join(parts)
+
+
+class MetadataProvider:
+    """
+    Base class of metadata providers.
+    Subclasses implement `fetch`, which returns a partial `BookData` or `None` if the book is not found,
+    and raises if the request failed. Results, including misses but not failures, are cached for `ttl` seconds.
+    """
+
+    name = "provider"
+
+    def __init__(self, base_url: str, timeout: float = 5.0, ttl: float = 24 * 3600, cache_size: int = 512) -> None:
+        self.base_url = base_url
+        self.timeout = timeout
+        self.ttl = ttl
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+
+    def fetch(self, isbn: int) -> dict | None:
+        raise NotImplementedError
+
+    def lookup(self, isbn: int) -> dict | None:
+        """Method to get metadata of the book, using the cache if possible."""
+        with self.lock:
+            entry = self.cache.get(isbn)
+            if entry and time.monotonic() - entry[0] < self.ttl:
+                self.cache.move_to_end(isbn)
+                return entry[1]
+
+        result = self.fetch(isbn)
+
+        with self.lock:
+            self.cache[isbn] = (time.monotonic(), result)
+            self.cache.move_to_end(isbn)
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        return result
+
+
+class GoogleBooksProvider(MetadataProvider):
+    """Provider for Google Books."""
+
+    name = "google_books"
+
+    def __init__(self, base_url: str = GoogleBooksClient.url, timeout: float = 5.0, **kwargs) -> None:
+        super().__init__(base_url, timeout=timeout, **kwargs)
+        self.client = GoogleBooksClient(timeout=(min(3.05, timeout), timeout))
+        self.client.url = base_url
+
+    def fetch(self, isbn: int) -> dict | None:
+        return self.client.parse(isbn, self.client.fetch_hedged(isbn))
+
+
+class OpenBDProvider(MetadataProvider):
+    """Provider for openBD (https://openbd.jp), which covers books published in Japan."""
+
+    name = "openbd"
+
+    def __init__(self, base_url: str = "https://api.openbd.jp/v1/get", timeout: float = 5.0, **kwargs) -> None:
+        super().__init__(base_url, timeout=timeout, **kwargs)
+
+    def fetch(self, isbn: int) -> dict | None:
+        res = requests.get(self.base_url, params={"isbn": isbn}, timeout=self.timeout)
+        res.raise_for_status()
+        data = res.json()
+        if not data or data[0] is None:
+            return None
+
+        summary = data[0].get("summary", {})
+        onix = data[0].get("onix", {})
+
+        authors = []
+        for contributor in onix.get("DescriptiveDetail", {}).get("Contributor", []):
+            name = contributor.get("PersonName", {}).get("content")
+            if name:
+                authors.append(name)
+        if not authors and summary.get("author"):
+            authors = [a.split("／")[0] for a in summary["author"].split(" ") if a]
+
+        description = None
+        for text in onix.get("CollateralDetail", {}).get("TextContent", []):
+            # 03: long description, 02: short description
+            if text.get("TextType") in ("03", "02") and text.get("Text"):
+                description = text["Text"]
+                if text["TextType"] == "03":
+                    break
+
+        return dict(
+            isbn=int(isbn),
+            title=summary.get("title") or None,
+            authors=authors or None,
+            published_date=normalize_date(summary.get("pubdate")),
+            description=description,
+            thumbnail_link=summary.get("cover") or None,
+        )
+
+
+class NDLProvider(MetadataProvider):
+    """Provider for National Diet Library Search OpenSearch API."""
+
+    name = "ndl"
+    namespaces = {
+        "dc": "http://purl.org/dc/elements/1.1/",
+        "dcterms": "http://purl.org/dc/terms/",
+    }
+
+    def __init__(
+        self, base_url: str = "https://ndlsearch.ndl.go.jp/api/opensearch", timeout: float = 5.0, **kwargs
+    ) -> None:
+        super().__init__(base_url, timeout=timeout, **kwargs)
+
+    def fetch(self, isbn: int) -> dict | None:
+        res = requests.get(self.base_url, params={"isbn": isbn, "cnt": 1}, timeout=self.timeout)
+        res.raise_for_status()
+        item = ET.fromstring(res.content).find("channel/item")
+        if item is None:
+            return None
+
+        authors = [e.text.strip() for e in item.findall("dc:creator", self.namespaces) if e.text]
+        issued = item.findtext("dcterms:issued", namespaces=self.namespaces)
+        description = item.findtext("dc:description", namespaces=self.namespaces)
+
+        return dict(
+            isbn=int(isbn),
+            title=item.findtext("title") or None,
+            authors=authors or None,
+            published_date=normalize_date(issued),
+            description=description or None,
+            thumbnail_link=None,
+        )
+
+
+class MetadataResolver:
+    """
+    Class for resolving book metadata from several providers at once.
+
+    All providers are queried in parallel. Each field is taken from the first provider in
+    `field_priority` (or provider order) that has a value. The result is returned as soon as every field
+    has a value which no pending provider ranks above, without waiting for lower-ranked providers.
+    """
+
+    def __init__(
+        self,
+        providers: list[MetadataProvider] | None = None,
+        field_priority: dict[str, list[str]] | None = None,
+        timeout: float = 8.0,
+        wrap=None,
+    ) -> None:
+        """
+        Parameters
+        ----------
+        providers: list[MetadataProvider] | None
+            Providers in order of priority. Google Books, openBD and NDL are used if `None`.
+        field_priority: dict[str, list[str]] | None
+            Order of provider names for each field, overriding provider order.
+        timeout: float
+            Maximum time to wait for providers in seconds.
+        wrap: Callable | None
+            Function applied to provider lookups run in worker threads, e.g. `Profiler.wrap`.
+        """
+        self.providers = providers or [GoogleBooksProvider(), OpenBDProvider(), NDLProvider()]
+        self.field_priority = field_priority or {}
+        self.timeout = timeout
+        self.wrap = wrap or (lambda fn: fn)
+        self.executor = ThreadPoolExecutor(max_workers=2 * len(self.providers), thread_name_prefix="metadata")
+
+    def merge(self, isbn: int, results: dict[str, dict]) -> BookData:
+        """Method to merge partial results by field priority."""
+        default_order = [p.name for p in self.providers]
+        bookdata = BookData(isbn=int(isbn), **{k: None for k in FIELDS})
+        for field in FIELDS:
+            for name in self.field_priority.get(field, default_order):
+                value = (results.get(name) or {}).get(field)
+                if value:
+                    bookdata[field] = value
+                    break
+        return bookdata
+
+    def is_settled(self, results: dict[str, dict], pending: set[str]) -> bool:
+        """
+        Method to check if pending providers can no longer change the merged result,
+        i.e. every field has a value from a provider ranked above all pending ones.
+        """
+        default_order = [p.name for p in self.providers]
+        for field in FIELDS:
+            for name in self.field_priority.get(field, default_order):
+                if name in pending:
+                    return False
+                if (results.get(name) or {}).get(field):
+                    break
+            else:
+                return False
+        return True
+
+    def resolve(self, isbn: int, verbose=False) -> BookData | None:
+        """
+        Method to search ISBN value in all providers.
+
+        Parameters
+        ----------
+        isbn: int
+        verbose: bool
+
+        Returns
+        -------
+        bookdata: BookData | None
+            Information about the book. Returns `None` if no provider knows its title.
+        """
+        futures = {self.executor.submit(self.wrap(p.lookup), isbn): p.name for p in self.providers}
+        results = {}
+        pending = set(futures)
+        deadline = time.monotonic() + self.timeout
+
+        while pending:
+            done, pending = wait(pending, timeout=max(deadline - time.monotonic(), 0), return_when=FIRST_COMPLETED)
+            if not done:
+                print("Metadata providers timed out: {}".format([futures[f] for f in pending]))
+                break
+            for f in done:
+                try:
+                    results[futures[f]] = f.result()
+                except Exception as e:
+                    print("Provider '{}' failed: {}".format(futures[f], e))
+                    results[futures[f]] = None
+            if self.is_settled(results, {futures[f] for f in pending}):
+                break
+
+        for f in pending:
+            f.cancel()
+
+        bookdata = self.merge(isbn, results)
+        if verbose:
+            print("Resolved from {}: {}".format([k for k, v in results.items() if v], bookdata))
+        return bookdata if bookdata["title"] else None
+
+
+if __name__ == "__main__":
+
+    resolver = MetadataResolver()
+    print(resolver.resolve(9784537214192, verbose=True))
@@ -7,6 +7,10 @@ from datetime import datetime
 
 import requests
 
+from src.http_cache import http_cache
+from src.schema import FIELD_MAPPING, DatabaseSchema, PageTemplate
+from src.snapshot import SnapshotWriter
+
 
 class NotionObject:
     def __init__(self) -> None:
@@ -43,9 +47,12 @@ class NotionObject:
 class NotionDB(NotionObject):
     """Class for handling Notion database."""
 
-    def __init__(self, databse_id: str) -> None:
+    def __init__(self, databse_id: str, mapping: dict[str, str] | None = None) -> None:
         super().__init__()
         self.database_id = databse_id
+        self.mapping = dict(FIELD_MAPPING, **(mapping or {}))
+        self.schema = DatabaseSchema(databse_id, self.headers, mapping=self.mapping)
+        self.template = PageTemplate(databse_id, mapping=self.mapping)
 
     def create_book_page(
         self,
@@ -62,71 +69,28 @@ class NotionDB(NotionObject):
         `isbn` and `title` should not be `None`.
         """
         url = "https://api.notion.com/v1/pages"
-
-        payload = {
-            "parent": {"database_id": self.database_id},
-            "properties": {"ISBN-13": {"number": isbn}, "名前": {"title": [{"text": {"content": title}}]}},
-            "children": [
-                {
-                    "object": "block",
-                    "type": "heading_2",
-                    "heading_2": {"rich_text": [{"type": "text", "text": {"content": "概要"}}]},
-                },
-            ],
-        }
-
-        # authors
-        if authors:
-            payload["properties"]["著者"] = {"multi_select": [{"name": n} for n in authors]}
-
-        # published date
-        if published_date:
-            payload["properties"]["出版年"] = {"date": {"start": published_date}}
-
-        # location
-        if location:
-            payload["properties"]["所蔵場所"] = {"select": {"name": location}}
-
-        # description
-        if description:
-            if len(description) > 2000:
-                print("len(description) was over 2000 ({})".format(len(description)))
-                description = description[:2000-4] + " ..."
-            payload["children"].append(
-                {
-                    "object": "block",
-                    "type": "quote",
-                    "quote": {"rich_text": [{"type": "text", "text": {"content": description}}]},
-                }
-            )
-        else:
-            payload["children"].append(
-                {
-                    "object": "block",
-                    "type": "quote",
-                    "quote": {
-                        "rich_text": [
-                            {
-                                "type": "text",
-                                "text": {"content": "書籍情報はありません。"},
-                                "annotations": {"color": "gray"},
-                            }
-                        ]
-                    },
-                }
-            )
-
-        # thumbnail
-        if thumbnail_link:
-            payload["cover"] = {"type": "external", "external": {"url": thumbnail_link}}
-        else:
-            payload["cover"] = {
-                "type": "external",
-                "external": {"url": "https://free-icons.net/wp-content/uploads/2020/08/life041.png"},
-            }
+        payload = self.template.build(
+            isbn=isbn,
+            title=title,
+            authors=authors,
+            published_date=published_date,
+            location=location,
+            description=description,
+            thumbnail_link=thumbnail_link,
+        )
 
         response = requests.post(url, headers=self.headers, json=payload)
         print(response)
+        if response.status_code == 200 and location:
+            try:
+                known = location in self.schema.location_options()
+            except (ValueError, requests.RequestException) as e:
+                # the page exists already; the schema is retrieved again next time
+                print("Failed to check location options: {}".format(e))
+                known = False
+            if not known:
+                # Notion adds unknown select options by itself
+                self.schema.invalidate()
         return response
 
     def get_isbn_list(self) -> list[int] | None:
@@ -150,7 +114,7 @@ class NotionDB(NotionObject):
                     continue
                 res_json = response.json()
                 li_isbn += [
-                    res_json["results"][i]["properties"]["ISBN-13"]["number"] for i in range(len(res_json["results"]))
+                    res_json["results"][i]["properties"][self.mapping["isbn"]]["number"] for i in range(len(res_json["results"]))
                 ]
                 has_more = res_json["has_more"]
                 next_cursor = res_json["next_cursor"]
@@ -173,18 +137,18 @@ class NotionDB(NotionObject):
         locations: list[str]
             Options for location select.
         """
-        url = f"https://api.notion.com/v1/databases/{self.database_id}"
-
-        response_data = requests.get(url, headers=self.headers).json()
-        options_data = response_data["properties"]["所蔵場所"]["select"]["options"]
+        return self.schema.location_options()
 
-        locations = []
-        for item in options_data:
-            loc = item["name"]
-            if not item in locations:
-                locations.append(loc)
+    def add_location_tag(self, loc: str):
+        """
+        Method to add an option for location select, so that it exists before any page uses it.
 
-        return locations
+        Parameters
+        ----------
+        loc: str
+            Name of new location tag.
+        """
+        self.schema.add_location_option(loc)
 
     def get_existing_pageid(self, isbn: int) -> list[str]:
         """
@@ -201,7 +165,7 @@ class NotionDB(NotionObject):
         """
         url = f"https://api.notion.com/v1/databases/{self.database_id}/query"
         filter = {
-            "property": "ISBN-13",
+            "property": self.mapping["isbn"],
             "number": {
                 "equals": isbn
             } 
@@ -233,11 +197,11 @@ class NotionDB(NotionObject):
             - `date`: str
             - `total_items`: int
             - `books`: dict
+                + `page_id`: str
                 + `isbn`: int
                 + `title`: str
                 + `location`: str
         """
-        url = f"https://api.notion.com/v1/databases/{self.database_id}/query"
         result = {
             "database_id": self.database_id, 
             "date": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
@@ -245,9 +209,38 @@ class NotionDB(NotionObject):
             "books": []
         }
 
+        for books, _, _ in self.iter_bookdata():
+            result["books"] += books
+
+        result["total_items"] = len(result["books"])
+
+        with open(filename, "w") as f:
+            json.dump(result, f, indent=4, ensure_ascii=False)
+
+        return result
+
+    def iter_bookdata(self, start_cursor: str | None = None):
+        """
+        Generator to fetch existing books page by page.
+
+        Parameters
+        ----------
+        start_cursor: str | None
+            Cursor to start the query from. Starts from the first page if `None`.
+
+        Yields
+        ------
+        books: list[dict]
+            Books in the page, with keys `page_id`, `isbn`, `title` and `location`.
+        next_cursor: str | None
+            Cursor of next page.
+        has_more: bool
+            Whether more pages follow.
+        """
+        url = f"https://api.notion.com/v1/databases/{self.database_id}/query"
+
         # query params
         has_more = True
-        start_cursor = None
         i = 0
 
         while has_more:
@@ -261,36 +254,78 @@ class NotionDB(NotionObject):
             if res.status_code != 200:
                 raise ValueError("Failed in API call.")
 
-            has_more = res.json()["has_more"]
-            start_cursor = res.json()["next_cursor"]
+            res_json = res.json()
+            has_more = res_json["has_more"]
+            start_cursor = res_json["next_cursor"]
+
+            books = []
+            for obj in res_json["results"]:
+                isbn = obj["properties"][self.mapping["isbn"]]["number"]
+                loc = obj["properties"][self.mapping["location"]]["select"]["name"]
+                title = obj["properties"][self.mapping["title"]]["title"][0]["text"]["content"]
+                books.append(dict(page_id=obj["id"], isbn=isbn, title=title, location=loc))
 
-            for obj in res.json()["results"]:
-                isbn = obj["properties"]["ISBN-13"]["number"]
-                loc = obj["properties"]["所蔵場所"]["select"]["name"]
-                title = obj["properties"]["名前"]["title"][0]["text"]["content"]
-                result["books"].append(dict(isbn=isbn, title=title, location=loc))
-            
+            yield books, start_cursor, has_more
             i += 1
 
-        result["total_items"] = len(result["books"])
+    def iter_books(self):
+        """Generator to fetch existing books one by one. See `iter_bookdata` for the keys."""
+        for books, _, _ in self.iter_bookdata():
+            yield from books
 
-        with open(filename, "w") as f:
-            json.dump(result, f, indent=4, ensure_ascii=False)
+    def export_snapshot(self, filename="bookdata.jsonl.gz", resume=True) -> SnapshotWriter:
+        """
+        Method to stream existing books into a gzip-compressed JSON Lines snapshot.
+        Each page is written as soon as it arrives, so an interrupted export can be resumed.
+        The previous snapshot is replaced only when the export is complete.
 
-        return result
+        Parameters
+        ----------
+        filename: str
+            Relative path of output file.
+        resume: bool
+            Continue from the cursor of an unfinished export of the same file.
+
+        Returns
+        -------
+        writer: SnapshotWriter
+            Finished writer. `writer.total_items` is the number of exported books.
+        """
+        writer = SnapshotWriter(filename, self.database_id, resume=resume)
+        try:
+            if writer.has_more:
+                for books, next_cursor, has_more in self.iter_bookdata(start_cursor=writer.start_cursor):
+                    writer.write_page(books, next_cursor, has_more)
+        except ValueError:
+            if not writer.resumed:
+                raise
+            # the recorded cursor may be rejected, e.g. after it expired
+            print("Failed to resume snapshot '{}'. Starting over.".format(filename))
+            writer.abort()
+            return self.export_snapshot(filename, resume=False)
+        writer.close()
+        return writer
 
 
 class NotionPage(NotionObject):
     """Class for handling Notion Page object."""
-    def __init__(self, page_id: str) -> None:
+    def __init__(self, page_id: str, location_property: str = FIELD_MAPPING["location"]) -> None:
         super().__init__()
         self.page_id = page_id
+        self.location_property = location_property
+
+    def get_location_tag(self, ttl: float = 60) -> str:
+        """
+        Method to acquire location tag.
 
-    def get_location_tag(self) -> str:
-        """Method to acquire location tag."""
+        Parameters
+        ----------
+        ttl: float
+            Seconds to reuse the page retrieved before. Updates from this app drop the cache.
+        """
         url = f"https://api.notion.com/v1/pages/{self.page_id}"
-        res = requests.get(url, headers=self.headers)
-        tag = res.json()["properties"]["所蔵場所"]["select"]["name"]
+        res = http_cache.get(url, headers=self.headers, ttl=ttl)
+        tag = res.json()["properties"][self.location_property]["select"]["name"]
         return tag
 
     def update_location(self, loc: str):
@@ -304,9 +339,10 @@ class NotionPage(NotionObject):
         """
         url = f"https://api.notion.com/v1/pages/{self.page_id}"
         properties = {
-            "所蔵場所": {"select": {"name": loc}}
+            self.location_property: {"select": {"name": loc}}
         }
         res = requests.patch(url, headers=self.headers, json=dict(properties=properties))
+        http_cache.invalidate(url)
         if res.status_code != 200:
             raise ValueError("Failed in API call.")
 
@@ -325,6 +361,7 @@ if __name__ == "__main__":
         tag = pg.get_location_tag()
         print(tag)
     # db.save_bookdata()
+    # db.export_snapshot()
 
     # db.create_book_page(
     #     isbn=978_0000_0000_00,
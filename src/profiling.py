@@ -0,0 +1,261 @@
+# Profiling hooks which can be turned on and off while the app is running.
+import cProfile
+import functools
+import os
+import pstats
+import sys
+import threading
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+
+# From Python 3.12, cProfile is built on sys.monitoring: a profile sees every thread,
+# and only one can be enabled in the process at a time.
+SHARED_PROFILE = sys.version_info >= (3, 12)
+
+
+class Profiler:
+    """
+    Class for profiling a running app. Reports are written to `directory`.
+
+    - cProfile of sections wrapped with `section`, and of work in other threads wrapped with `wrap`
+      (`*.pstats`, readable with `pstats` or snakeviz).
+    - Sampled call stacks of all threads (`*.folded`, collapsed stacks for flamegraph.pl or speedscope).
+    - tracemalloc snapshots, compared with the previous one (`*.txt`).
+    """
+
+    def __init__(self, directory: str = "profiles", sample_interval: float = 0.02) -> None:
+        """
+        Parameters
+        ----------
+        directory: str
+            Directory of reports.
+        sample_interval: float
+            Interval of stack sampling in seconds.
+        """
+        self.directory = directory
+        self.sample_interval = sample_interval
+        self.profile = None
+        self.active = 0  # number of open sections
+        self.enable_failed = False
+        self.thread_stats = None
+        self.lock = threading.Lock()
+        self.sampler = None
+        self.samples = Counter()
+        self.stop_event = threading.Event()
+        self.last_snapshot = None
+
+    def report_path(self, kind: str, ext: str) -> str:
+        os.makedirs(self.directory, exist_ok=True)
+        return os.path.join(self.directory, "{}-{}.{}".format(kind, datetime.now().strftime("%Y%m%d-%H%M%S"), ext))
+
+    # --- cProfile ---
+    @property
+    def profiling(self) -> bool:
+        return self.profile is not None
+
+    def start_profile(self):
+        """Method to start collecting cProfile statistics of sections."""
+        with self.lock:
+            if self.profile is None:
+                self.profile = cProfile.Profile()
+                self.active = 0
+                self.enable_failed = False
+                print("cProfile started.")
+
+    def stop_profile(self) -> str | None:
+        """Method to stop cProfile and write statistics. Returns path of the report."""
+        with self.lock:
+            profile, self.profile = self.profile, None
+            thread_stats, self.thread_stats = self.thread_stats, None
+            self.active = 0
+        if profile is None:
+            return None
+        profile.create_stats()
+        if not profile.stats:
+            # pstats refuses a profile which was never enabled
+            stats = thread_stats
+        else:
+            stats = pstats.Stats(profile)
+            if thread_stats is not None:
+                stats.add(thread_stats)
+        if stats is None:
+            print("cProfile stopped. Nothing was profiled.")
+            return None
+        path = self.report_path("cprofile", "pstats")
+        stats.dump_stats(path)
+        print("cProfile stopped. Saved '{}'".format(path))
+        return path
+
+    def enable(self) -> cProfile.Profile | None:
+        """
+        Method to enable the profile when the first section opens.
+        Returns the enabled profile, or `None` if cProfile is off or another profiler (e.g. a debugger) is active.
+        """
+        with self.lock:
+            profile = self.profile
+            if profile is None:
+                return None
+            if self.active == 0:
+                try:
+                    profile.enable()
+                except ValueError as e:
+                    if not self.enable_failed:
+                        print("cProfile could not be enabled: {}".format(e))
+                        self.enable_failed = True
+                    return None
+            self.active += 1
+            return profile
+
+    def disable(self, profile: cProfile.Profile):
+        """Method to disable the profile when the last section closes."""
+        with self.lock:
+            # sections left open while cProfile was restarted belong to the old profile
+            if profile is not self.profile:
+                return
+            self.active -= 1
+            if self.active == 0:
+                profile.disable()
+
+    @contextmanager
+    def section(self):
+        """
+        Context manager to profile a block while cProfile is on. Costs nothing otherwise.
+        Sections can be nested. Keep modal dialogs outside sections, or time spent waiting for the user is profiled.
+        """
+        profile = self.enable()
+        try:
+            yield
+        finally:
+            if profile is not None:
+                self.disable(profile)
+
+    def wrap(self, fn):
+        """
+        Method to make a function profiled in whichever thread runs it, e.g. work submitted to an executor,
+        which `section` on the main thread cannot see.
+        From Python 3.12, the one profile of the process sees every thread, and the call is profiled as a section.
+        Before that, each call is profiled separately and merged into the report.
+        """
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if SHARED_PROFILE:
+                with self.section():
+                    return fn(*args, **kwargs)
+
+            session = self.profile
+            if session is None:
+                return fn(*args, **kwargs)
+            profile = cProfile.Profile()
+            profile.enable()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                profile.disable()
+                with self.lock:
+                    # calls still running when cProfile stopped are dropped
+                    if self.profile is session:
+                        if self.thread_stats is None:
+                            self.thread_stats = pstats.Stats(profile)
+                        else:
+                            self.thread_stats.add(profile)
+
+        return wrapper
+
+    # --- sampling ---
+    @property
+    def sampling(self) -> bool:
+        return self.sampler is not None
+
+    def start_sampling(self):
+        """Method to start sampling call stacks of all threads."""
+        if self.sampler is None:
+            self.samples.clear()
+            self.stop_event.clear()
+            self.sampler = threading.Thread(target=self.sample_loop, name="profiler-sampler", daemon=True)
+            self.sampler.start()
+            print("Sampling started ({:.0f} Hz).".format(1 / self.sample_interval))
+
+    def stop_sampling(self) -> str | None:
+        """Method to stop sampling and write collapsed stacks. Returns path of the report."""
+        if self.sampler is None:
+            return None
+        self.stop_event.set()
+        self.sampler.join()
+        self.sampler = None
+        path = self.report_path("stacks", "folded")
+        with open(path, "w") as f:
+            for stack, count in self.samples.most_common():
+                f.write("{} {}\n".format(stack, count))
+        print("Sampling stopped. Saved '{}' ({} samples)".format(path, sum(self.samples.values())))
+        return path
+
+    def sample_loop(self):
+        own_id = threading.get_ident()
+        names = {}
+        while not self.stop_event.wait(self.sample_interval):
+            if len(names) != threading.active_count():
+                names = {t.ident: t.name for t in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append("{} ({}:{})".format(code.co_name, os.path.basename(code.co_filename), code.co_firstlineno))
+                    frame = frame.f_back
+                stack.append(names.get(thread_id, str(thread_id)))
+                self.samples[";".join(reversed(stack))] += 1
+
+    # --- tracemalloc ---
+    def take_snapshot(self, limit: int = 25) -> str:
+        """
+        Method to take a tracemalloc snapshot and write top allocations, compared with the previous snapshot.
+        Tracing starts at the first call, so the first report has no difference.
+
+        Parameters
+        ----------
+        limit: int
+            Number of allocation sites in the report.
+
+        Returns
+        -------
+        path: str
+            Path of the report.
+        """
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(10)
+        snapshot = tracemalloc.take_snapshot().filter_traces(
+            [tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, "<frozen importlib._bootstrap>")]
+        )
+        path = self.report_path("tracemalloc", "txt")
+        current, peak = tracemalloc.get_traced_memory()
+        with open(path, "w") as f:
+            f.write("traced: {:.1f} MiB (peak {:.1f} MiB)\n\n".format(current / 2**20, peak / 2**20))
+            f.write("Top allocations\n")
+            for stat in snapshot.statistics("lineno")[:limit]:
+                f.write("{}\n".format(stat))
+            if self.last_snapshot is not None:
+                f.write("\nDifference from previous snapshot\n")
+                for stat in snapshot.compare_to(self.last_snapshot, "lineno")[:limit]:
+                    f.write("{}\n".format(stat))
+        self.last_snapshot = snapshot
+        print("Saved '{}'".format(path))
+        return path
+
+    def stop_tracemalloc(self):
+        """Method to stop tracing memory allocations."""
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+        self.last_snapshot = None
+
+    def toggle(self):
+        """Method to start cProfile and sampling together, or stop both and write reports."""
+        if self.profiling or self.sampling:
+            self.stop_profile()
+            self.stop_sampling()
+        else:
+            self.start_profile()
+            self.start_sampling()
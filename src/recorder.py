@@ -0,0 +1,240 @@
+# Record camera frames and HTTP exchanges of a session, and replay them offline.
+import gzip
+import hashlib
+import json
+import os
+import struct
+import threading
+import time
+from collections import defaultdict, deque
+
+import cv2
+import numpy as np
+import requests
+
+# header of each frame record: timestamp, camera index, size of JPEG data
+FRAME_HEADER = struct.Struct("<diI")
+
+
+def request_key(method: str, url: str, body) -> str:
+    """Function to make a key identifying a request regardless of its headers."""
+    if isinstance(body, str):
+        body = body.encode("utf-8")
+    digest = hashlib.sha1(body or b"").hexdigest()
+    return "{} {} {}".format(method, url, digest)
+
+
+class SessionRecorder:
+    """
+    Class for recording a session into `directory`.
+
+    - `frames.bin`: JPEG-compressed frames of every camera with timestamps.
+    - `http.jsonl.gz`: every request sent through `requests` and its response, with timestamps and latency.
+      Authorization headers are not recorded.
+    """
+
+    def __init__(self, directory: str, jpeg_quality: int = 80) -> None:
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.jpeg_quality = jpeg_quality
+        self.frames_file = open(os.path.join(directory, "frames.bin"), "wb")
+        self.http_file = gzip.open(os.path.join(directory, "http.jsonl.gz"), "wt", encoding="utf-8")
+        self.lock = threading.Lock()
+        self.t0 = time.monotonic()
+        self.original_send = None
+
+    def start(self):
+        """Method to start recording HTTP exchanges."""
+        self.original_send = requests.Session.send
+        recorder = self
+
+        def send(session, request, **kwargs):
+            start = time.monotonic()
+            response = recorder.original_send(session, request, **kwargs)
+            recorder.record_http(request, response, start, time.monotonic() - start)
+            return response
+
+        requests.Session.send = send
+        print("Recording session into '{}'".format(self.directory))
+
+    def stop(self):
+        """Method to stop recording and close files."""
+        if self.original_send:
+            requests.Session.send = self.original_send
+            self.original_send = None
+        with self.lock:
+            self.frames_file.close()
+            self.http_file.close()
+
+    def record_frame(self, cam: int, frame):
+        """
+        Method to record a BGR frame.
+
+        Parameters
+        ----------
+        cam: int
+            Index of camera.
+        frame: numpy.ndarray
+        """
+        ok, buf = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, self.jpeg_quality])
+        if not ok:
+            return
+        data = buf.tobytes()
+        with self.lock:
+            if not self.frames_file.closed:
+                self.frames_file.write(FRAME_HEADER.pack(time.monotonic() - self.t0, cam, len(data)))
+                self.frames_file.write(data)
+
+    def record_http(self, request, response, start: float, latency: float):
+        exchange = {
+            "t": start - self.t0,
+            "latency": latency,
+            "key": request_key(request.method, request.url, request.body),
+            "method": request.method,
+            "url": request.url,
+            "status_code": response.status_code,
+            "headers": {k: v for k, v in response.headers.items() if k.lower() not in ("set-cookie",)},
+            "content": response.content.decode("latin-1"),
+            "encoding": response.encoding,
+        }
+        with self.lock:
+            if not self.http_file.closed:
+                self.http_file.write(json.dumps(exchange) + "\n")
+
+
+class ReplayCapture:
+    """
+    Class imitating `cv2.VideoCapture` with recorded frames.
+    Frames are returned at recorded timing divided by `speed`, or as fast as possible if `speed` is 0.
+    If `loop` is `True`, frames are repeated from the beginning after the last one.
+    """
+
+    def __init__(
+        self, filename: str, records: list[tuple[float, int, int]], speed: float = 1.0, loop: bool = False
+    ) -> None:
+        self.file = open(filename, "rb")
+        self.records = records
+        self.speed = speed
+        self.loop = loop
+        self.position = 0
+        self.start = None
+        self.shape = self.decode(0).shape if records else (0, 0, 3)
+
+    def decode(self, i: int):
+        _, offset, size = self.records[i]
+        self.file.seek(offset)
+        return cv2.imdecode(np.frombuffer(self.file.read(size), dtype=np.uint8), cv2.IMREAD_COLOR)
+
+    def isOpened(self) -> bool:
+        return not self.file.closed and len(self.records) > 0
+
+    def read(self):
+        if self.loop and self.records and self.position >= len(self.records):
+            self.position = 0
+            self.start = None
+        if self.file.closed or self.position >= len(self.records):
+            return False, None
+        t = self.records[self.position][0] - self.records[0][0]
+        if self.start is None:
+            self.start = time.monotonic()
+        if self.speed > 0:
+            delay = self.start + t / self.speed - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+        frame = self.decode(self.position)
+        self.position += 1
+        return True, frame
+
+    def get(self, prop: int) -> float:
+        if prop == cv2.CAP_PROP_FRAME_WIDTH:
+            return float(self.shape[1])
+        if prop == cv2.CAP_PROP_FRAME_HEIGHT:
+            return float(self.shape[0])
+        if prop == cv2.CAP_PROP_FOURCC:
+            return float(cv2.VideoWriter_fourcc(*"MJPG"))
+        return 0.0
+
+    def set(self, prop: int, value: float) -> bool:
+        return False
+
+    def release(self):
+        self.file.close()
+
+
+class SessionReplayer:
+    """
+    Class for replaying a session recorded by `SessionRecorder`.
+
+    Requests are answered with recorded responses to the same method, URL and body, in recorded order,
+    after the recorded latency divided by `speed`. Requests which were not recorded raise `requests.ConnectionError`.
+    """
+
+    def __init__(self, directory: str, speed: float = 1.0) -> None:
+        self.directory = directory
+        self.speed = speed
+        self.exchanges = defaultdict(deque)
+        self.lock = threading.Lock()
+        self.original_send = None
+
+        with gzip.open(os.path.join(directory, "http.jsonl.gz"), "rt", encoding="utf-8") as f:
+            for line in f:
+                exchange = json.loads(line)
+                self.exchanges[exchange["key"]].append(exchange)
+
+        # index of frames for each camera: (timestamp, offset, size)
+        self.frames = defaultdict(list)
+        self.frames_filename = os.path.join(directory, "frames.bin")
+        with open(self.frames_filename, "rb") as f:
+            while header := f.read(FRAME_HEADER.size):
+                if len(header) < FRAME_HEADER.size:
+                    break
+                t, cam, size = FRAME_HEADER.unpack(header)
+                self.frames[cam].append((t, f.tell(), size))
+                f.seek(size, os.SEEK_CUR)
+
+    def cameras(self) -> list[int]:
+        """Method to get indexes of recorded cameras."""
+        return sorted(self.frames)
+
+    def capture(self, cam: int, loop: bool = False) -> ReplayCapture:
+        """Method to get a capture replaying frames of given camera."""
+        return ReplayCapture(self.frames_filename, self.frames[cam], speed=self.speed, loop=loop)
+
+    def start(self):
+        """Method to start answering requests with recorded responses."""
+        self.original_send = requests.Session.send
+        replayer = self
+
+        def send(session, request, **kwargs):
+            return replayer.respond(request)
+
+        requests.Session.send = send
+        print("Replaying session from '{}' (speed: {})".format(self.directory, self.speed or "max"))
+
+    def stop(self):
+        """Method to stop replaying."""
+        if self.original_send:
+            requests.Session.send = self.original_send
+            self.original_send = None
+
+    def respond(self, request) -> requests.Response:
+        key = request_key(request.method, request.url, request.body)
+        with self.lock:
+            queue = self.exchanges.get(key)
+            if not queue:
+                raise requests.ConnectionError("Request was not recorded: {} {}".format(request.method, request.url))
+            # the last response is kept for requests repeated more than recorded
+            exchange = queue.popleft() if len(queue) > 1 else queue[0]
+
+        if self.speed > 0:
+            time.sleep(exchange["latency"] / self.speed)
+
+        response = requests.Response()
+        response.status_code = exchange["status_code"]
+        response.url = exchange["url"]
+        response.headers.update(exchange["headers"])
+        response.headers.pop("Content-Encoding", None)
+        response._content = exchange["content"].encode("latin-1")
+        response.encoding = exchange["encoding"]
+        response.request = request
+        return response
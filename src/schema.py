@@ -0,0 +1,186 @@
+# Cached schema of Notion database and page payload templates.
+import threading
+import time
+
+import requests
+
+from src.http_cache import http_cache
+
+# names of database properties for each field of a book
+FIELD_MAPPING = {
+    "isbn": "ISBN-13",
+    "title": "名前",
+    "authors": "著者",
+    "published_date": "出版年",
+    "location": "所蔵場所",
+}
+
+# property type expected for each field
+FIELD_TYPES = {
+    "isbn": "number",
+    "title": "title",
+    "authors": "multi_select",
+    "published_date": "date",
+    "location": "select",
+}
+
+DEFAULT_COVER = "https://free-icons.net/wp-content/uploads/2020/08/life041.png"
+
+
+class DatabaseSchema:
+    """
+    Class for caching the definition of a Notion database.
+
+    The database is retrieved on first use and kept for `ttl` seconds, or until `invalidate` is called.
+    """
+
+    def __init__(self, database_id: str, headers: dict, mapping: dict[str, str] | None = None, ttl: float = 600) -> None:
+        """
+        Parameters
+        ----------
+        database_id: str
+        headers: dict
+            Headers of Notion API requests.
+        mapping: dict[str, str] | None
+            Names of database properties for each field. `FIELD_MAPPING` is used if `None`.
+        ttl: float
+            Lifetime of the cache in seconds.
+        """
+        self.database_id = database_id
+        self.headers = headers
+        self.mapping = dict(FIELD_MAPPING, **(mapping or {}))
+        self.ttl = ttl
+        self.data = None
+        self.fetched_at = 0.0
+        self.lock = threading.Lock()
+
+    def get(self) -> dict:
+        """Method to get the database object, retrieving it if the cache is empty or expired."""
+        with self.lock:
+            if self.data is None or time.monotonic() - self.fetched_at > self.ttl:
+                url = f"https://api.notion.com/v1/databases/{self.database_id}"
+                res = http_cache.get(url, headers=self.headers, ttl=self.ttl)
+                if res.status_code != 200:
+                    raise ValueError("Failed in API call.")
+                self.data = res.json()
+                self.fetched_at = time.monotonic()
+            return self.data
+
+    def invalidate(self):
+        """Method to drop the cache so that next access retrieves the database again."""
+        with self.lock:
+            self.data = None
+        http_cache.invalidate(f"https://api.notion.com/v1/databases/{self.database_id}")
+
+    def validate(self):
+        """Method to check that every mapped property exists with the expected type. Raises `ValueError` otherwise."""
+        properties = self.get()["properties"]
+        errors = []
+        for field, name in self.mapping.items():
+            if name not in properties:
+                errors.append("Property '{}' for '{}' doesn't exist.".format(name, field))
+            elif properties[name]["type"] != FIELD_TYPES[field]:
+                errors.append(
+                    "Property '{}' for '{}' should be '{}', not '{}'.".format(
+                        name, field, FIELD_TYPES[field], properties[name]["type"]
+                    )
+                )
+        if errors:
+            raise ValueError("\n".join(errors))
+
+    def location_options(self) -> list[str]:
+        """Method to get existing options for location select."""
+        options = self.get()["properties"][self.mapping["location"]]["select"]["options"]
+        locations = []
+        for item in options:
+            if item["name"] not in locations:
+                locations.append(item["name"])
+        return locations
+
+    def add_location_option(self, loc: str):
+        """
+        Method to add an option to location select of the database.
+
+        Parameters
+        ----------
+        loc: str
+            Name of new location tag.
+        """
+        if loc in self.location_options():
+            return
+        options = [{"name": name} for name in self.location_options()] + [{"name": loc}]
+        url = f"https://api.notion.com/v1/databases/{self.database_id}"
+        properties = {self.mapping["location"]: {"select": {"options": options}}}
+        res = requests.patch(url, headers=self.headers, json=dict(properties=properties))
+        self.invalidate()
+        if res.status_code != 200:
+            raise ValueError("Failed in API call.")
+
+
+class PageTemplate:
+    """
+    Class for building payloads of book pages.
+    Parts shared by every page are built once, and `build` only fills in values of each book.
+    """
+
+    def __init__(self, database_id: str, mapping: dict[str, str] | None = None) -> None:
+        self.mapping = dict(FIELD_MAPPING, **(mapping or {}))
+        self.parent = {"database_id": database_id}
+        self.heading = {
+            "object": "block",
+            "type": "heading_2",
+            "heading_2": {"rich_text": [{"type": "text", "text": {"content": "概要"}}]},
+        }
+        self.no_description = {
+            "object": "block",
+            "type": "quote",
+            "quote": {
+                "rich_text": [
+                    {
+                        "type": "text",
+                        "text": {"content": "書籍情報はありません。"},
+                        "annotations": {"color": "gray"},
+                    }
+                ]
+            },
+        }
+        self.default_cover = {"type": "external", "external": {"url": DEFAULT_COVER}}
+
+    def build(
+        self,
+        isbn: int,
+        title: str,
+        authors: list[str] | None,
+        published_date: str | None,
+        location: str,
+        description: str | None,
+        thumbnail_link: str | None,
+    ) -> dict:
+        """Method to build payload of `POST /v1/pages` for a book. Shared parts are referenced, not copied."""
+        m = self.mapping
+        properties = {m["isbn"]: {"number": isbn}, m["title"]: {"title": [{"text": {"content": title}}]}}
+        if authors:
+            properties[m["authors"]] = {"multi_select": [{"name": n} for n in authors]}
+        if published_date:
+            properties[m["published_date"]] = {"date": {"start": published_date}}
+        if location:
+            properties[m["location"]] = {"select": {"name": location}}
+
+        if description:
+            if len(description) > 2000:
+                print("len(description) was over 2000 ({})".format(len(description)))
+                description = description[:2000-4] + " ..."
+            quote = {
+                "object": "block",
+                "type": "quote",
+                "quote": {"rich_text": [{"type": "text", "text": {"content": description}}]},
+            }
+        else:
+            quote = self.no_description
+
+        if thumbnail_link:
+            cover = {"type": "external", "external": {"url": thumbnail_link}}
+        else:
+            cover = self.default_cover
+
+        return {"parent": self.parent, "properties": properties, "children": [self.heading, quote], "cover": cover}
@@ -0,0 +1,289 @@
+# Streaming snapshot of Notion database as gzip-compressed JSON Lines.
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import time
+from datetime import datetime
+from typing import Iterator
+
+
+class SnapshotWriter:
+    """
+    Class for writing book rows into a gzip-compressed JSON Lines file page by page.
+
+    The first line of a snapshot is a header (`database_id`, `date`), followed by one line per book.
+    Rows are written into a temporary file (`<filename>.part`), which replaces `filename` when the export is closed,
+    so that the previous complete snapshot survives a failed export.
+    Every page is appended as an independent gzip member and flushed to disk, and the position of the
+    file and the Notion query cursor are recorded in a sidecar state file (`<filename>.cursor`).
+    If an export is interrupted, a new writer for the same file resumes from the recorded cursor,
+    unless the state is older than `max_age` seconds. Then the export starts over, so that a snapshot
+    doesn't mix rows fetched at distant times.
+    """
+
+    def __init__(self, filename: str, database_id: str, resume: bool = True, max_age: float = 600) -> None:
+        self.filename = filename
+        self.part_filename = filename + ".part"
+        self.state_filename = filename + ".cursor"
+        self.database_id = database_id
+        self.start_cursor = None
+        self.has_more = True
+        self.total_items = 0
+        self.resumed = False
+
+        state = self.load_state() if resume else None
+        if state and time.time() - state.get("saved_at", 0) > max_age:
+            print("Snapshot state of '{}' is outdated. Starting over.".format(filename))
+            state = None
+        if state and state["database_id"] == database_id and os.path.exists(self.part_filename):
+            # drop rows written after the last recorded page
+            with open(self.part_filename, "r+b") as f:
+                f.truncate(state["offset"])
+            self.start_cursor = state["next_cursor"]
+            self.has_more = state["has_more"]
+            self.total_items = state["total_items"]
+            self.resumed = True
+            print("Resuming snapshot '{}' from {} items".format(filename, self.total_items))
+        else:
+            with open(self.part_filename, "wb"):
+                pass
+            header = {"database_id": database_id, "date": datetime.now().strftime("%Y-%m-%d %H:%M:%S")}
+            self._append([header], next_cursor=None, has_more=True, count=0)
+
+    def load_state(self) -> dict | None:
+        """Method to read the sidecar state file. Returns `None` if there is no unfinished export."""
+        try:
+            with open(self.state_filename, "r") as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def write_page(self, books: list[dict], next_cursor: str | None, has_more: bool):
+        """
+        Method to append rows of one page and record the cursor of next page.
+
+        Parameters
+        ----------
+        books: list[dict]
+            Rows of the page.
+        next_cursor: str | None
+            Cursor to resume the query from.
+        has_more: bool
+            Whether more pages follow.
+        """
+        self._append(books, next_cursor=next_cursor, has_more=has_more, count=len(books))
+
+    def close(self):
+        """
+        Method to finish the export. The temporary file replaces `filename`,
+        and the state file is removed so that next export starts over.
+        """
+        os.replace(self.part_filename, self.filename)
+        if os.path.exists(self.state_filename):
+            os.remove(self.state_filename)
+
+    def abort(self):
+        """Method to drop an unfinished export, keeping the previous snapshot."""
+        for path in (self.part_filename, self.state_filename):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def _append(self, rows: list[dict], next_cursor: str | None, has_more: bool, count: int):
+        data = "".join(json.dumps(r, ensure_ascii=False) + "\n" for r in rows).encode("utf-8")
+        with open(self.part_filename, "ab") as f:
+            f.write(gzip.compress(data, compresslevel=6))
+            f.flush()
+            os.fsync(f.fileno())
+            offset = f.tell()
+        self.start_cursor = next_cursor
+        self.has_more = has_more
+        self.total_items += count
+        state = {
+            "database_id": self.database_id,
+            "next_cursor": next_cursor,
+            "has_more": has_more,
+            "offset": offset,
+            "total_items": self.total_items,
+            "saved_at": time.time(),
+        }
+        tmp = self.state_filename + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(state, f)
+        os.replace(tmp, self.state_filename)
+
+
+def read_snapshot(filename: str) -> tuple[dict, Iterator[dict]]:
+    """
+    Function to read a snapshot without loading the entire file into memory.
+
+    Parameters
+    ----------
+    filename: str
+        Path of snapshot written by `SnapshotWriter`.
+
+    Returns
+    -------
+    header: dict
+        Header of the snapshot (`database_id`, `date`).
+    books: Iterator[dict]
+        Rows of the snapshot, decoded lazily.
+    """
+    f = gzip.open(filename, "rt", encoding="utf-8")
+    header = json.loads(f.readline())
+
+    def rows():
+        with f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+    return header, rows()
+
+
+def load_isbn_list(filename: str) -> list[int]:
+    """Function to get the list of ISBN in a snapshot."""
+    _, books = read_snapshot(filename)
+    return [b["isbn"] for b in books]
+
+
+def open_export(filename: str) -> tuple[dict, Iterator[dict]]:
+    """
+    Function to read an export, either a snapshot (`.jsonl.gz`) or `save_bookdata` output (`.json`), once.
+
+    Returns
+    -------
+    header: dict
+        Header of the export (`database_id`, `date`).
+    books: Iterator[dict]
+        Rows of the export.
+    """
+    if filename.endswith(".gz"):
+        return read_snapshot(filename)
+    with open(filename, "r") as f:
+        data = json.load(f)
+    books = data.pop("books")
+    return data, iter(books)
+
+
+def iter_books(filename: str) -> Iterator[dict]:
+    """
+    Function to iterate books in an export, either a snapshot (`.jsonl.gz`) or `save_bookdata` output (`.json`).
+    """
+    _, books = open_export(filename)
+    yield from books
+
+
+def row_digest(book: dict) -> bytes:
+    """Function to hash the fields compared by `diff_books`."""
+    data = "{}\x1f{}".format(book.get("title"), book.get("location"))
+    return hashlib.blake2b(data.encode("utf-8"), digest_size=8).digest()
+
+
+def diff_books(old_books, new_books, key: str = "isbn") -> dict:
+    """
+    Function to compare two sets of books in a single pass over each.
+
+    Parameters
+    ----------
+    old_books: Iterable[dict]
+        Books of older export.
+    new_books: Iterable[dict]
+        Books of newer export, or `NotionDB.iter_books()` for the live database.
+    key: str
+        Field to match books by, `"isbn"` or `"page_id"`.
+        Duplicated ISBNs are matched in order of appearance.
+        Raises `ValueError` if a row has no such field, e.g. `page_id` in exports written before it was recorded.
+
+    Returns
+    -------
+    diff: dict
+        `diff` has following keys:
+        - `added`: list[dict]
+        - `removed`: list[dict]
+        - `retitled`: list[tuple[dict, dict]]
+            Pairs of (old, new) books.
+        - `relocated`: list[tuple[dict, dict]]
+            Pairs of (old, new) books.
+    """
+    def keyed(books):
+        seen = {}
+        for b in books:
+            if key not in b:
+                raise ValueError(
+                    "A row has no '{}'. Exports written before page ids were recorded can only be "
+                    "compared by ISBN.".format(key)
+                )
+            k = b[key]
+            n = seen.get(k, 0)
+            seen[k] = n + 1
+            yield (k, n), b
+
+    index = {k: (row_digest(b), b) for k, b in keyed(old_books)}
+    diff = {"added": [], "removed": [], "retitled": [], "relocated": []}
+
+    for k, new in keyed(new_books):
+        entry = index.pop(k, None)
+        if entry is None:
+            diff["added"].append(new)
+            continue
+        digest, old = entry
+        if digest == row_digest(new):
+            continue
+        if old.get("title") != new.get("title"):
+            diff["retitled"].append((old, new))
+        if old.get("location") != new.get("location"):
+            diff["relocated"].append((old, new))
+
+    diff["removed"] = [b for _, b in index.values()]
+    return diff
+
+
+def diff_snapshots(old_filename: str, new_filename: str, key: str = "isbn") -> dict:
+    """Function to compare two exports. See `diff_books` for the returned value."""
+    return diff_books(iter_books(old_filename), iter_books(new_filename), key=key)
+
+
+def print_diff(diff: dict):
+    """Function to print the result of `diff_books`. Missing fields are shown as `None`."""
+    for b in diff["added"]:
+        print("+ {} '{}' [{}]".format(b.get("isbn"), b.get("title"), b.get("location")))
+    for b in diff["removed"]:
+        print("- {} '{}' [{}]".format(b.get("isbn"), b.get("title"), b.get("location")))
+    for old, new in diff["retitled"]:
+        print("~ {} '{}' → '{}'".format(new.get("isbn"), old.get("title"), new.get("title")))
+    for old, new in diff["relocated"]:
+        print(
+            "> {} '{}' [{}] → [{}]".format(new.get("isbn"), new.get("title"), old.get("location"), new.get("location"))
+        )
+    print(
+        "added: {}, removed: {}, retitled: {}, relocated: {}".format(
+            *(len(diff[k]) for k in ("added", "removed", "retitled", "relocated"))
+        )
+    )
+
+
+if __name__ == "__main__":
+
+    # python -m src.snapshot OLD [NEW]
+    # compares with the live database if NEW is omitted
+    parser = argparse.ArgumentParser(description="Compare two book exports.")
+    parser.add_argument("old", help="older export (.jsonl.gz or .json)")
+    parser.add_argument("new", nargs="?", help="newer export; live database if omitted")
+    parser.add_argument("--key", choices=["isbn", "page_id"], default="isbn")
+    args = parser.parse_args()
+
+    header, old_books = open_export(args.old)
+    if args.new:
+        new_books = iter_books(args.new)
+    else:
+        from src.notion import NotionDB
+
+        db = NotionDB(databse_id=header["database_id"])
+        new_books = db.iter_books()
+
+    try:
+        print_diff(diff_books(old_books, new_books, key=args.key))
+    except ValueError as e:
+        parser.error(str(e))
@@ -0,0 +1,433 @@
+# Soak test running scan → lookup → upload headlessly against local API fakes.
+#
+#   python -m src.soak --hours 12
+#   python -m src.soak --session sessions/station-1 --minutes 30
+#
+# Frames come from a recorded session (see `--record` of gui.py) or from synthetic EAN-13 barcodes.
+# RSS, open file descriptors, thread count and latency of each stage are sampled during the run,
+# and the run fails if they drift beyond thresholds after warm-up.
+import argparse
+import csv
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import defaultdict
+from contextlib import contextmanager
+from urllib.parse import parse_qs, urlsplit
+
+import cv2
+import numpy as np
+import requests
+
+import src.camera
+from src.camera import CameraWorker, ISBNStream
+from src.library import Library
+from src.recorder import SessionReplayer
+from src.schema import FIELD_MAPPING
+from src.station import Station
+
+STAGES = ["decode", "lookup", "upload", "duplicate_check", "update"]
+
+# --- synthetic frames ---
+EAN_L = ["0001101", "0011001", "0010011", "0111101", "0100011", "0110001", "0101111", "0111011", "0110111", "0001011"]
+EAN_R = ["".join("1" if b == "0" else "0" for b in code) for code in EAN_L]
+EAN_G = [code[::-1] for code in EAN_R]
+EAN_PARITY = ["LLLLLL", "LLGLGG", "LLGGLG", "LLGGGL", "LGLLGG", "LGGLLG", "LGGGLL", "LGLGLG", "LGLGGL", "LGGLGL"]
+
+
+def make_isbn(rng: random.Random) -> int:
+    """Function to make a random valid ISBN-13."""
+    digits = [9, 7, 8] + [rng.randrange(10) for _ in range(9)]
+    check = (10 - sum(d * (1 if i % 2 == 0 else 3) for i, d in enumerate(digits)) % 10) % 10
+    return int("".join(map(str, digits + [check])))
+
+
+def draw_ean13(isbn: int, size: tuple[int, int] = (640, 480), module: int = 3):
+    """Function to draw EAN-13 barcode of given ISBN on a white BGR frame."""
+    digits = [int(c) for c in str(isbn)]
+    parity = EAN_PARITY[digits[0]]
+    bits = "101"
+    for d, p in zip(digits[1:7], parity):
+        bits += EAN_L[d] if p == "L" else EAN_G[d]
+    bits += "01010"
+    for d in digits[7:]:
+        bits += EAN_R[d]
+    bits += "101"
+
+    width, height = size
+    frame = np.full((height, width, 3), 255, dtype=np.uint8)
+    x0 = (width - len(bits) * module) // 2
+    y0, y1 = height // 3, 2 * height // 3
+    for i, b in enumerate(bits):
+        if b == "1":
+            frame[y0:y1, x0 + i * module : x0 + (i + 1) * module] = 0
+    return frame
+
+
+class SyntheticCapture:
+    """
+    Class imitating `cv2.VideoCapture`, showing each ISBN of `isbns` in turn for `hold` frames,
+    separated by `gap` blank frames, at `fps` frames per second.
+    """
+
+    def __init__(self, isbns: list[int], fps: float = 25, hold: int = 15, gap: int = 10, seed: int = 0) -> None:
+        self.isbns = isbns
+        self.fps = fps
+        self.hold = hold
+        self.gap = gap
+        self.rng = random.Random(seed)
+        self.blank = np.full((480, 640, 3), 255, dtype=np.uint8)
+        self.frames = {}
+        self.position = 0
+        self.current = None
+        self.opened = True
+        self.last = time.monotonic()
+
+    def isOpened(self) -> bool:
+        return self.opened
+
+    def read(self):
+        if not self.opened:
+            return False, None
+        delay = self.last + 1 / self.fps - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        self.last = time.monotonic()
+
+        i = self.position % (self.hold + self.gap)
+        if i == 0:
+            self.current = self.rng.choice(self.isbns)
+        self.position += 1
+        if i >= self.hold:
+            return True, self.blank.copy()
+        if self.current not in self.frames:
+            self.frames[self.current] = draw_ean13(self.current)
+        return True, self.frames[self.current].copy()
+
+    def get(self, prop: int) -> float:
+        return {cv2.CAP_PROP_FRAME_WIDTH: 640.0, cv2.CAP_PROP_FRAME_HEIGHT: 480.0}.get(prop, 0.0)
+
+    def set(self, prop: int, value: float) -> bool:
+        return False
+
+    def release(self):
+        self.opened = False
+
+
+# --- local API fakes ---
+class FakeAPI:
+    """
+    Class answering requests of Notion, Google Books, openBD, NDL and cover images in process,
+    after `latency` seconds. Pages created through the fake are kept in memory.
+    """
+
+    def __init__(self, locations: dict[str, list[str]], latency: float = 0.0) -> None:
+        """
+        Parameters
+        ----------
+        locations: dict[str, list[str]]
+            Location options of each database.
+        latency: float
+            Seconds to wait before each response.
+        """
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.pages = {}
+        self.options = {db_id: list(options) for db_id, options in locations.items()}
+        self.original_send = None
+        ok, buf = cv2.imencode(".jpg", np.full((192, 128, 3), 128, dtype=np.uint8))
+        self.cover = buf.tobytes()
+
+    def start(self):
+        self.original_send = requests.Session.send
+        requests.Session.send = lambda session, request, **kwargs: self.respond(request)
+
+    def stop(self):
+        if self.original_send:
+            requests.Session.send = self.original_send
+            self.original_send = None
+
+    @staticmethod
+    def make_response(request, data=None, status_code: int = 200, content: bytes | None = None, content_type="application/json"):
+        response = requests.Response()
+        response.status_code = status_code
+        response.url = request.url
+        response.headers["Content-Type"] = content_type
+        response._content = content if content is not None else json.dumps(data).encode("utf-8")
+        response.encoding = "utf-8"
+        response.request = request
+        return response
+
+    def respond(self, request) -> requests.Response:
+        if self.latency:
+            time.sleep(self.latency)
+        url = urlsplit(request.url)
+        body = json.loads(request.body) if request.body else {}
+        if url.hostname == "api.notion.com":
+            return self.notion(request, url.path.split("/")[2:], body)
+        if url.hostname == "www.googleapis.com":
+            isbn = parse_qs(url.query)["q"][0].split(":")[1]
+            volume_info = {
+                "title": "Book {}".format(isbn),
+                "authors": ["Author {}".format(isbn[-3:])],
+                "publishedDate": "2020-01-01",
+                "description": "Description of {}".format(isbn),
+                "imageLinks": {"thumbnail": "http://covers.local/{}.jpg".format(isbn)},
+            }
+            return self.make_response(request, {"totalItems": 1, "items": [{"volumeInfo": volume_info}]})
+        if url.hostname == "api.openbd.jp":
+            return self.make_response(request, [None])
+        if url.hostname == "ndlsearch.ndl.go.jp":
+            return self.make_response(request, content=b"<rss><channel></channel></rss>", content_type="application/xml")
+        if url.hostname == "covers.local":
+            return self.make_response(request, content=self.cover, content_type="image/jpeg")
+        return self.make_response(request, {"message": "not found"}, status_code=404)
+
+    def notion(self, request, path: list[str], body: dict) -> requests.Response:
+        m = FIELD_MAPPING
+        with self.lock:
+            if path[0] == "databases" and len(path) == 2 and request.method == "GET":
+                properties = {name: {"type": t} for name, t in [
+                    (m["isbn"], "number"), (m["title"], "title"), (m["authors"], "multi_select"),
+                    (m["published_date"], "date"), (m["location"], "select"),
+                ]}
+                properties[m["location"]]["select"] = {"options": [{"name": n} for n in self.options[path[1]]]}
+                return self.make_response(request, {"id": path[1], "properties": properties})
+
+            if path[0] == "databases" and len(path) == 2 and request.method == "PATCH":
+                options = body["properties"][m["location"]]["select"]["options"]
+                self.options[path[1]] = [o["name"] for o in options]
+                return self.make_response(request, {"id": path[1]})
+
+            if path[0] == "databases" and path[2:] == ["query"]:
+                pages = [p for p in self.pages.values() if p["parent"]["database_id"] == path[1]]
+                if "filter" in body:
+                    isbn = body["filter"]["number"]["equals"]
+                    pages = [p for p in pages if p["properties"][m["isbn"]]["number"] == isbn]
+                    return self.make_response(request, {"results": pages, "has_more": False, "next_cursor": None})
+                start = int(body.get("start_cursor") or 0)
+                end = start + 100
+                return self.make_response(
+                    request,
+                    {"results": pages[start:end], "has_more": end < len(pages), "next_cursor": str(end) if end < len(pages) else None},
+                )
+
+            if path[0] == "pages" and len(path) == 1 and request.method == "POST":
+                page = {"id": str(uuid.uuid4()), "parent": body["parent"], "properties": body["properties"]}
+                self.pages[page["id"]] = page
+                return self.make_response(request, page)
+
+            if path[0] == "pages" and len(path) == 2:
+                page = self.pages.get(path[1])
+                if page is None:
+                    return self.make_response(request, {"code": "object_not_found", "message": ""}, status_code=404)
+                if request.method == "PATCH":
+                    page["properties"].update(body["properties"])
+                return self.make_response(request, page)
+
+        return self.make_response(request, {"code": "invalid_request_url", "message": ""}, status_code=400)
+
+
+# --- measurement ---
+def get_rss() -> float:
+    """Function to get resident set size of this process in MiB."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except OSError:
+        import resource
+
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2**10
+
+
+def get_fd_count() -> int | None:
+    """Function to get the number of open file descriptors. Returns `None` if unknown."""
+    for path in ("/proc/self/fd", "/dev/fd"):
+        if os.path.isdir(path):
+            return len(os.listdir(path))
+    return None
+
+
+class Monitor:
+    """Class for recording latencies of stages and sampling resource usage over time."""
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.samples = []
+        self.t0 = time.monotonic()
+
+    @contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self.lock:
+                self.latencies[name].append(elapsed)
+
+    def sample(self, **extra) -> dict:
+        """Method to record resource usage and latency percentiles since the previous sample."""
+        with self.lock:
+            latencies, self.latencies = self.latencies, defaultdict(list)
+        row = dict(
+            t=round(time.monotonic() - self.t0, 1),
+            rss_mb=round(get_rss(), 1),
+            fds=get_fd_count(),
+            threads=threading.active_count(),
+            **extra,
+        )
+        for name in STAGES:
+            values = sorted(latencies.get(name, []))
+            row[name + "_n"] = len(values)
+            row[name + "_p95_ms"] = round(1000 * values[int(0.95 * (len(values) - 1))], 2) if values else None
+        self.samples.append(row)
+        return row
+
+
+def check_drift(samples: list[dict], warmup: float, args) -> list[str]:
+    """
+    Function to compare resource usage at the end of the run with the end of warm-up.
+
+    Returns
+    -------
+    errors: list[str]
+        Descriptions of exceeded thresholds. Empty if the run passed.
+    """
+    measured = [s for s in samples if s["t"] >= warmup]
+    if len(measured) < 4:
+        return ["Too few samples after warm-up ({}).".format(len(measured))]
+    base, last = measured[0], measured[-1]
+    errors = []
+    if last["rss_mb"] - base["rss_mb"] > args.max_rss_growth:
+        errors.append("RSS grew {:.1f} MiB ({} → {})".format(last["rss_mb"] - base["rss_mb"], base["rss_mb"], last["rss_mb"]))
+    if base["fds"] is not None and last["fds"] - base["fds"] > args.max_fd_growth:
+        errors.append("Open files grew by {} ({} → {})".format(last["fds"] - base["fds"], base["fds"], last["fds"]))
+    if last["threads"] - base["threads"] > args.max_thread_growth:
+        errors.append("Threads grew by {} ({} → {})".format(last["threads"] - base["threads"], base["threads"], last["threads"]))
+
+    # compare first and last quarter of measured samples
+    quarter = max(len(measured) // 4, 1)
+    for name in STAGES:
+        key = name + "_p95_ms"
+        first = [s[key] for s in measured[:quarter] if s[key] is not None]
+        latest = [s[key] for s in measured[-quarter:] if s[key] is not None]
+        if first and latest:
+            before, after = float(np.median(first)), float(np.median(latest))
+            if before > 0 and after / before > args.max_latency_ratio and after - before > args.min_latency_delta:
+                errors.append("p95 latency of '{}' grew {:.1f}x ({:.1f} ms → {:.1f} ms)".format(name, after / before, before, after))
+    return errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Soak test of scan → lookup → upload loop.")
+    parser.add_argument("--hours", type=float, default=0.0)
+    parser.add_argument("--minutes", type=float, default=10.0, help="used if --hours is 0")
+    parser.add_argument("--session", metavar="DIR", help="recorded session to replay frames from (looped)")
+    parser.add_argument("--cameras", type=int, default=2, help="number of synthetic cameras")
+    parser.add_argument("--books", type=int, default=200, help="number of distinct synthetic ISBNs")
+    parser.add_argument("--databases", type=int, default=2)
+    parser.add_argument("--latency", type=float, default=0.01, help="latency of fake APIs in seconds")
+    parser.add_argument("--sample-interval", type=float, default=10.0)
+    parser.add_argument("--warmup", type=float, default=60.0, help="seconds excluded from drift baseline")
+    parser.add_argument("--max-rss-growth", type=float, default=64.0, help="MiB")
+    parser.add_argument("--max-fd-growth", type=int, default=8)
+    parser.add_argument("--max-thread-growth", type=int, default=4)
+    parser.add_argument("--max-latency-ratio", type=float, default=2.0)
+    parser.add_argument("--min-latency-delta", type=float, default=5.0, help="ms; smaller growth is ignored")
+    parser.add_argument("--report", default="soak.csv", help="CSV of samples")
+    args = parser.parse_args()
+
+    duration = 3600 * args.hours if args.hours else 60 * args.minutes
+    report = os.path.abspath(args.report)
+    os.environ.setdefault("NOTION_API_KEY", "soak")
+
+    # snapshots and caches are written into a scratch directory
+    os.chdir(tempfile.mkdtemp(prefix="soak-"))
+    print("Working directory: {}".format(os.getcwd()))
+
+    database_ids = ["soak-db-{}".format(i) for i in range(args.databases)]
+    locations = {db_id: ["{}-A".format(db_id), "{}-B".format(db_id)] for db_id in database_ids}
+    api = FakeAPI(locations, latency=args.latency)
+    api.start()
+
+    monitor = Monitor()
+    scan_isbn = src.camera.scan_isbn
+
+    def timed_scan_isbn(frame):
+        with monitor.stage("decode"):
+            return scan_isbn(frame)
+
+    src.camera.scan_isbn = timed_scan_isbn
+
+    library = Library(database_ids)
+    library.validate()
+    library.sync()
+    # dialogs are answered "yes"; each camera scans for its own location, so books are also relocated across databases
+    station = Station(library, stage=monitor.stage)
+    locations = library.get_locations()
+
+    stream = ISBNStream()
+    if args.session:
+        replayer = SessionReplayer(args.session, speed=1.0)
+        captures = {cam: replayer.capture(cam, loop=True) for cam in replayer.cameras()}
+    else:
+        rng = random.Random(0)
+        isbns = [make_isbn(rng) for _ in range(args.books)]
+        captures = {cam: SyntheticCapture(isbns, seed=cam) for cam in range(args.cameras)}
+    workers = [CameraWorker(cam, stream, vcap=vcap) for cam, vcap in captures.items()]
+    for w in workers:
+        w.start()
+
+    detections = 0
+    next_sample = time.monotonic() + args.sample_interval
+    end = time.monotonic() + duration
+    try:
+        while time.monotonic() < end:
+            detected = stream.drain()
+            detections += len(detected)
+            station.prefetch([isbn for _, isbn in detected])
+            for cam, isbn in detected:
+                station.handle_isbn(isbn, locations[cam % len(locations)])
+            if time.monotonic() >= next_sample:
+                row = monitor.sample(detections=detections, books=len(api.pages), **station.counts)
+                print(row)
+                next_sample += args.sample_interval
+            time.sleep(0.02)
+    except KeyboardInterrupt:
+        print("Interrupted.")
+    finally:
+        for w in workers:
+            w.stop()
+        for w in workers:
+            w.join(timeout=5)
+        station.shutdown()
+        api.stop()
+        src.camera.scan_isbn = scan_isbn
+
+    fieldnames = []
+    for row in monitor.samples:
+        fieldnames += [k for k in row if k not in fieldnames]
+    with open(report, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=fieldnames)
+        writer.writeheader()
+        writer.writerows(monitor.samples)
+    print("Saved '{}'".format(report))
+
+    errors = check_drift(monitor.samples, args.warmup, args)
+    if errors:
+        print("FAILED")
+        for e in errors:
+            print("  " + e)
+        sys.exit(1)
+    print("PASSED ({} detections, {})".format(detections, dict(station.counts)))
+
+
+if __name__ == "__main__":
+    main()
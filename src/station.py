@@ -0,0 +1,191 @@
+# Pipeline from detected ISBNs to Notion, shared by the GUI and the soak test.
+from collections import defaultdict
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import nullcontext
+
+import requests
+
+from src.covers import CoverCache
+from src.google_books import BookData
+from src.library import Library
+from src.metadata import MetadataResolver
+from src.notion import NotionPage
+
+
+class Station:
+    """
+    Class for handling detected books without GUI: duplicate check, lookup of books and covers in background,
+    upload and update of location.
+
+    Questions to the user are answered by callbacks, so that the GUI can show dialogs
+    while the soak test answers them by itself.
+    """
+
+    def __init__(
+        self,
+        library: Library,
+        resolver: MetadataResolver | None = None,
+        covers: CoverCache | None = None,
+        ask_update=None,
+        confirm_upload=None,
+        notify=None,
+        on_failure=None,
+        stage=None,
+        wrap=None,
+    ) -> None:
+        """
+        Parameters
+        ----------
+        library: Library
+            Databases to add books to.
+        resolver: MetadataResolver | None
+            Resolver of book metadata. Google Books, openBD and NDL are used if `None`.
+        covers: CoverCache | None
+            Cache of cover thumbnails.
+        ask_update: Callable[[int, list[str], str, bool], bool] | None
+            Called with ISBN, current location tags, new location and whether the location belongs to another
+            database than the book.
+            Returns `True` to update the location. Locations are always updated if `None`.
+        confirm_upload: Callable[[dict], bool] | None
+            Called with information about a new book. Returns `True` to upload it. Always uploaded if `None`.
+        notify: Callable[[str, str], None] | None
+            Called with title and message when no book is found.
+        on_failure: Callable[[requests.Response], None] | None
+            Called with the response of a failed upload.
+        stage: Callable[[str], ContextManager] | None
+            Function making a context manager around the work of each stage
+            (`duplicate_check`, `lookup`, `upload` and `update`), e.g. for profiling or timing.
+        wrap: Callable | None
+            Function applied to lookups run in worker threads, e.g. `Profiler.wrap`.
+        """
+        self.library = library
+        self.wrap = wrap or (lambda fn: fn)
+        self.resolver = resolver or MetadataResolver(wrap=wrap)
+        self.covers = covers or CoverCache()
+        self.ask_update = ask_update or (lambda isbn, tags, location, other_db: True)
+        self.confirm_upload = confirm_upload or (lambda bookdata: True)
+        self.notify = notify or (lambda title, message: None)
+        self.on_failure = on_failure or (lambda res: None)
+        self.stage = stage or (lambda name: nullcontext())
+        self.book_futures = {}
+        self.lookup_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="lookup")
+        self.counts = defaultdict(int)
+
+    def prefetch(self, isbns: list[int]):
+        """Method to start looking up detected books which are not in the library yet."""
+        for isbn in isbns:
+            if isbn not in self.library:
+                self.prefetch_book(isbn)
+
+    def prefetch_book(self, isbn: int) -> Future:
+        """
+        Method to start looking up the book and its cover in background.
+
+        Parameters
+        ----------
+        isbn: int
+
+        Returns
+        -------
+        future: Future
+            Future of `MetadataResolver.resolve`.
+        """
+        if isbn not in self.book_futures:
+            future = self.lookup_executor.submit(self.wrap(self.resolver.resolve), isbn)
+            future.add_done_callback(self.prefetch_cover)
+            self.book_futures[isbn] = future
+        return self.book_futures[isbn]
+
+    def prefetch_cover(self, future: Future):
+        """Callback to start loading the cover once the book is looked up."""
+        if future.exception() is None and future.result():
+            self.covers.prefetch(future.result()["thumbnail_link"])
+
+    def lookup(self, isbn: int) -> BookData | None:
+        """Method to wait for the book looked up in background. Returns `None` if no book is found."""
+        try:
+            with self.stage("lookup"):
+                return self.prefetch_book(isbn).result()
+        finally:
+            self.book_futures.pop(isbn, None)
+
+    def handle_isbn(self, isbn: int, location: str) -> str:
+        """
+        Method to add the detected book, or update its location if it already exists.
+
+        Parameters
+        ----------
+        isbn: int
+        location: str
+            Location tag of the camera which saw the book.
+
+        Returns
+        -------
+        result: str
+            One of `added`, `updated`, `skipped`, `not_found` and `failed`.
+        """
+        pages = []
+        if isbn in self.library:
+            with self.stage("duplicate_check"):
+                pages = self.library.get_existing_pageid(isbn)
+                tags = [NotionPage(page_id, location_property=db.mapping["location"]).get_location_tag() for db, page_id in pages]
+
+        if pages:
+            db, page_id = pages[0]
+            # the page is updated in place so that hand-entered fields and content are kept;
+            # a tag owned by another database is added to this one, which doesn't change routing of new books
+            other_db = self.library.db_for_location(location) is not db
+            if not self.ask_update(isbn, tags, location, other_db):
+                result = "skipped"
+            else:
+                with self.stage("update"):
+                    NotionPage(page_id, location_property=db.mapping["location"]).update_location(loc=location)
+                    if other_db:
+                        db.schema.invalidate()
+                result = "updated"
+        else:
+            result = self.upload_book(isbn, location)
+
+        self.counts[result] += 1
+        return result
+
+    def upload_book(self, isbn: int, location: str) -> str:
+        """
+        Method to upload given book (ISBN) to the database of its location after confirmation.
+
+        Parameters
+        ----------
+        isbn: int
+        location: str
+            Location tag of the book.
+
+        Returns
+        -------
+        result: str
+            One of `added`, `skipped`, `not_found` and `failed`.
+        """
+        bookdata = self.lookup(isbn)
+        if not bookdata:
+            self.notify("Book not found", "No book found for ISBN: {}".format(isbn))
+            return "not_found"
+
+        bookdata = dict(bookdata, location=location)
+        print(bookdata)
+        if not self.confirm_upload(bookdata):
+            return "skipped"
+        with self.stage("upload"):
+            res = self.library.create_book_page(**bookdata)
+        if res.status_code == 200:
+            print("Successfully added.")
+            return "added"
+        self.report_failure(res)
+        return "failed"
+
+    def report_failure(self, res: requests.Response):
+        print("Request failed.")
+        print(res.json())
+        self.on_failure(res)
+
+    def shutdown(self):
+        """Method to stop lookups which haven't started yet."""
+        self.lookup_executor.shutdown(wait=False, cancel_futures=True)